@@ -14,6 +14,12 @@ def create_app():
     app.config['SECRET_KEY'] = 'logist-trans-secret-key-2026'
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///logist_trans.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JOB_WORKERS'] = 2
+    app.config['SLA_MONITOR'] = True
+    # Потоковая отрисовка больших списков. Включать после проверки шаблонов vehicles,
+    # warehouse, driver/routes и driver/notifications: строки в них нельзя передавать
+    # в |length и loop.length (RowStream не имеет длины)
+    app.config['STREAM_LIST_PAGES'] = False
     
     # Инициализация БД
     db.init_app(app)
@@ -27,4 +33,12 @@ def create_app():
     app.register_blueprint(driver_bp)
     app.register_blueprint(api_bp)
     
+    # Исполнители фоновой очереди задач
+    from app.jobs import init_app as init_jobs
+    init_jobs(app)
+    
+    # Монитор сроков доставки
+    from app.sla import init_app as init_sla
+    init_sla(app)
+    
     return app
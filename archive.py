@@ -0,0 +1,151 @@
+"""Архивирование доставленных заказов в отдельную БД SQLite (ATTACH ... AS archive)"""
+import json
+import os
+from datetime import datetime, timedelta
+
+ARCHIVE_PATH = 'logist_trans_archive.db'
+# Доставленные заказы старше этого срока переносятся в архив, дней
+ARCHIVE_AFTER_DAYS = 180
+# Количество заказов, переносимых в одной транзакции
+ARCHIVE_BATCH_SIZE = 500
+
+# Архивируемые таблицы и столбец со ссылкой на заказ (в порядке переноса)
+ARCHIVED_TABLES = (
+    ('order_status_history', 'order_id'),
+    ('warehouse', 'order_id'),
+    ('routes', 'order_id'),
+    ('orders', 'id'),
+)
+
+def table_columns(db, schema, table):
+    """Имена и типы столбцов таблицы в указанной схеме"""
+    return [(row[1], row[2]) for row in db.execute(f'PRAGMA {schema}.table_info({table})')]
+
+def create_archive_table(db, table):
+    """Архивная таблица со столбцами основной и первичным ключом id
+
+    Повторный перенос той же строки (INSERT OR IGNORE) не создает дубликата.
+    """
+    columns = ', '.join(f'{name} {column_type}' + (' PRIMARY KEY' if name == 'id' else '')
+                        for name, column_type in table_columns(db, 'main', table))
+    db.execute(f'CREATE TABLE archive.{table} ({columns})')
+
+def sync_archive_schema(db):
+    """Создание архивных таблиц и добавление в них новых столбцов основной схемы
+
+    Таблицы архивов прежних версий без первичного ключа пересоздаются, повторы строк
+    при этом отбрасываются.
+    """
+    for table, key in ARCHIVED_TABLES:
+        archived = {row[1]: row[5] for row in db.execute(f'PRAGMA archive.table_info({table})')}
+        if not archived:
+            create_archive_table(db, table)
+        elif not archived.get('id'):
+            db.execute(f'ALTER TABLE archive.{table} RENAME TO {table}_legacy')
+            create_archive_table(db, table)
+            columns = ', '.join(name for name, _ in table_columns(db, 'main', table) if name in archived)
+            db.execute(f'INSERT OR IGNORE INTO archive.{table} ({columns}) '
+                       f'SELECT {columns} FROM archive.{table}_legacy')
+            db.execute(f'DROP TABLE archive.{table}_legacy')
+        else:
+            for name, column_type in table_columns(db, 'main', table):
+                if name not in archived:
+                    db.execute(f'ALTER TABLE archive.{table} ADD COLUMN {name} {column_type}')
+        db.execute(f'CREATE INDEX IF NOT EXISTS archive.idx_{table}_{key} ON {table}({key})')
+
+def attach_archive(db, path=ARCHIVE_PATH, create=False):
+    """Подключение архивной БД к соединению как схемы archive
+
+    Без create отсутствующий архив не создается, и функция возвращает False. Схема
+    архива не проверяется: ее обновляют archive_orders и upgrade_archive.
+    """
+    if not create and not os.path.exists(path):
+        return False
+    db.execute('ATTACH DATABASE ? AS archive', (path,))
+    return True
+
+def upgrade_archive(db, path=ARCHIVE_PATH):
+    """Обновление схемы существующей архивной БД до текущей схемы основной"""
+    if not attach_archive(db, path):
+        return
+    try:
+        sync_archive_schema(db)
+        db.commit()
+    finally:
+        if db.in_transaction:
+            db.rollback()
+        db.execute('DETACH DATABASE archive')
+
+def archive_orders(db, days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, path=ARCHIVE_PATH):
+    """Перенос доставленных заказов старше days дней с маршрутами, складскими записями и историей
+
+    Партия переносится в два шага: копирование в архив и его фиксация, затем
+    удаление из основной БД отдельной транзакцией. В режиме WAL фиксация
+    транзакции, изменяющей обе БД, не атомарна, а при такой схеме сбой между
+    шагами оставляет строки в обеих БД, и повторный запуск (INSERT OR IGNORE по
+    первичному ключу архива) завершает перенос. Удаляются только строки, уже
+    записанные в архив. Возвращает количество перенесенных заказов.
+    """
+    attach_archive(db, path, create=True)
+    try:
+        sync_archive_schema(db)
+        db.commit()
+
+        cutoff = (datetime.now() - timedelta(days=days)).date()
+        columns = {table: ', '.join(name for name, _ in table_columns(db, 'main', table))
+                   for table, _ in ARCHIVED_TABLES}
+
+        total = 0
+        while True:
+            db.execute('BEGIN IMMEDIATE')
+            ids = [row[0] for row in db.execute('''
+                SELECT id FROM main.orders
+                WHERE status = 'Доставлен' AND COALESCE(actual_delivery_date, order_date) < ?
+                LIMIT ?
+            ''', (cutoff, batch_size))]
+            if not ids:
+                db.rollback()
+                break
+
+            batch = json.dumps(ids)
+            for table, key in ARCHIVED_TABLES:
+                db.execute(f'''
+                    INSERT OR IGNORE INTO archive.{table} ({columns[table]})
+                    SELECT {columns[table]} FROM main.{table} WHERE {key} IN (SELECT value FROM json_each(?))
+                ''', (batch,))
+            db.commit()
+
+            db.execute('BEGIN IMMEDIATE')
+            for table, key in ARCHIVED_TABLES:
+                db.execute(f'''
+                    DELETE FROM main.{table}
+                    WHERE {key} IN (SELECT value FROM json_each(?))
+                      AND id IN (SELECT id FROM archive.{table} WHERE {key} IN (SELECT value FROM json_each(?)))
+                ''', (batch, batch))
+            db.commit()
+            total += len(ids)
+    finally:
+        # Архив отключается и при ошибке: незавершенная партия откатывается,
+        # иначе DETACH невозможен, а соединение останется в транзакции
+        if db.in_transaction:
+            db.rollback()
+        db.execute('DETACH DATABASE archive')
+
+    return total
+
+if __name__ == '__main__':
+    # Запуск архивирования: python -m app.archive [--days 180] [--batch 500]
+    import argparse
+    import sqlite3
+
+    parser = argparse.ArgumentParser(description='Архивирование доставленных заказов')
+    parser.add_argument('--db', default='logist_trans.db')
+    parser.add_argument('--archive', default=ARCHIVE_PATH)
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--batch', type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    moved = archive_orders(conn, args.days, args.batch, args.archive)
+    conn.close()
+    print(f'Перенесено в архив заказов: {moved}')
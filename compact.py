@@ -0,0 +1,77 @@
+"""Компактные ответы API: колоночный JSON и сжатие gzip/deflate"""
+import gzip
+import json
+import zlib
+
+# Тип содержимого колоночного формата (запрашивается через Accept или ?format=columnar)
+COLUMNAR_MIMETYPE = 'application/vnd.logist.columnar+json'
+# Ответы меньше этого размера не сжимаются, байт
+COMPRESS_MIN_SIZE = 1024
+
+def encode_columnar(columns, rows):
+    """Колоночный JSON: {"columns": [...], "values": [[значения столбца], ...], "count": n}
+
+    rows: кортежи значений (например, строки курсора без row_factory), без
+    промежуточных словарей на каждую строку.
+    """
+    values = [list(column) for column in zip(*rows)] or [[] for _ in columns]
+    count = len(values[0]) if values else 0
+    return json.dumps({'columns': columns, 'values': values, 'count': count},
+                      ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+def compress(body, encoding):
+    """Сжатие тела ответа кодировкой 'gzip' или 'deflate'"""
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return zlib.compress(body, 6)
+
+if __name__ == '__main__':
+    # Сравнение форматов на больших списках: python -m app.compact
+    import random
+    import sqlite3
+    import time
+
+    random.seed(0)
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE vehicles (id INTEGER PRIMARY KEY, brand TEXT, model TEXT, license_plate TEXT, capacity REAL)')
+    db.executemany('INSERT INTO vehicles VALUES (?, ?, ?, ?, ?)',
+                   [(i, random.choice(('Volvo', 'Mercedes', 'КАМАЗ', 'MAN', 'Scania')), random.choice(('FH16', 'Actros', '6520')),
+                     f'А{i:06d}77', random.choice((10.0, 18.0, 20.5, 25.0))) for i in range(1, 100_001)])
+    db.execute('CREATE TABLE drivers (id INTEGER PRIMARY KEY, full_name TEXT, experience_years INTEGER, '
+               'license_number TEXT, is_available INTEGER)')
+    db.executemany('INSERT INTO drivers VALUES (?, ?, ?, ?, ?)',
+                   [(i, f'{random.choice(("Иванов", "Петров", "Сидоров", "Козлов"))} {random.choice("АБВГДЕ")}.'
+                        f'{random.choice("АБВГДЕ")}.', random.randint(1, 30), f'77 {i:08d}', 1)
+                    for i in range(1, 100_001)])
+    db.execute('CREATE TABLE history (old_status TEXT, new_status TEXT, changed_at TIMESTAMP, notes TEXT)')
+    db.executemany('INSERT INTO history VALUES (?, ?, ?, ?)',
+                   [('Создан', 'Назначен', f'2026-01-{i % 28 + 1:02d} 12:00:00', 'Статус изменен') for i in range(100_000)])
+
+    def measure(query):
+        cursor = db.cursor()
+        cursor.row_factory = sqlite3.Row
+        started = time.perf_counter()
+        rows = cursor.execute(query).fetchall()
+        # Формат jsonify(): словарь на строку, sort_keys и ensure_ascii как в Flask
+        plain = json.dumps([dict(r) for r in rows], sort_keys=True, separators=(',', ':')).encode()
+        plain_time = time.perf_counter() - started
+
+        cursor = db.cursor()
+        started = time.perf_counter()
+        cursor.execute(query)
+        columnar = encode_columnar([d[0] for d in cursor.description], cursor.fetchall())
+        columnar_time = time.perf_counter() - started
+
+        for name, body, elapsed in (('jsonify', plain, plain_time), ('columnar', columnar, columnar_time)):
+            started = time.perf_counter()
+            packed = compress(body, 'gzip')
+            gzip_time = time.perf_counter() - started
+            print(f'  {name:9} {len(body) / 1024:9.0f} КБ, {elapsed * 1000:5.0f} мс; '
+                  f'gzip: {len(packed) / 1024:6.0f} КБ, +{gzip_time * 1000:4.0f} мс')
+
+    for title, query in (('ТС, 100K строк', 'SELECT id, brand, model, license_plate, capacity FROM vehicles'),
+                         ('Водители, 100K строк', 'SELECT id, full_name, experience_years, license_number '
+                                                  'FROM drivers WHERE is_available = 1'),
+                         ('История статусов, 100K строк', 'SELECT * FROM history')):
+        print(title)
+        measure(query)
@@ -0,0 +1,16 @@
+"""Значения фильтров списков с количеством записей (из кеш-таблицы facet_counts)"""
+
+def get_facets(db, table, column):
+    """Значения столбца с количеством записей, упорядоченные по значению
+
+    Строки содержат ключ с именем столбца (как у SELECT DISTINCT) и count.
+    """
+    if not column.isidentifier():
+        raise ValueError(f'Некорректное имя столбца: {column}')
+    
+    return db.execute(f'''
+        SELECT value AS {column}, count
+        FROM facet_counts
+        WHERE table_name = ? AND column_name = ? AND count > 0
+        ORDER BY value
+    ''', (table, column)).fetchall()
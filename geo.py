@@ -0,0 +1,71 @@
+"""Оценка расстояний между адресами по координатам городов"""
+import math
+from functools import lru_cache
+
+# Координаты городов (широта, долгота)
+CITY_COORDINATES = {
+    'Москва': (55.7558, 37.6173),
+    'Санкт-Петербург': (59.9343, 30.3351),
+    'Екатеринбург': (56.8389, 60.6057),
+    'Новосибирск': (55.0084, 82.9357),
+    'Казань': (55.7961, 49.1064),
+    'Нижний Новгород': (56.2965, 43.9361),
+    'Самара': (53.1959, 50.1002),
+    'Челябинск': (55.1644, 61.4368),
+    'Омск': (54.9885, 73.3242),
+    'Ростов-на-Дону': (47.2357, 39.7015),
+    'Уфа': (54.7388, 55.9721),
+    'Красноярск': (56.0153, 92.8932),
+    'Пермь': (58.0105, 56.2502),
+    'Воронеж': (51.6720, 39.1843),
+    'Волгоград': (48.7080, 44.5133),
+    'Краснодар': (45.0355, 38.9753),
+    'Тюмень': (57.1522, 65.5272),
+    'Тверь': (56.8587, 35.9176),
+    'Ярославль': (57.6261, 39.8845),
+    'Владимир': (56.1291, 40.4070),
+    'Тула': (54.1961, 37.6182),
+    'Рязань': (54.6292, 39.7364),
+    'Калуга': (54.5293, 36.2754),
+    'Смоленск': (54.7826, 32.0453),
+    'Великий Новгород': (58.5213, 31.2710),
+}
+
+# Отношение длины дороги к расстоянию по прямой
+ROAD_FACTOR = 1.25
+# Расстояние перевозки в пределах одного города, км
+LOCAL_DISTANCE_KM = 25.0
+
+_coordinates = {name.casefold(): coords for name, coords in CITY_COORDINATES.items()}
+
+def city_of(address):
+    """Город адреса: часть до первой запятой без префикса 'г.'"""
+    city = (address or '').split(',', 1)[0].strip()
+    if city.casefold().startswith('г.'):
+        city = city[2:].strip()
+    return city
+
+def city_coordinates(city):
+    """Координаты города или None, если город неизвестен"""
+    return _coordinates.get(city.casefold())
+
+@lru_cache(maxsize=4096)
+def city_distance_km(city_from, city_to):
+    """Дорожное расстояние между городами, км (None, если город неизвестен)"""
+    if city_from.casefold() == city_to.casefold():
+        return 0.0
+
+    a, b = city_coordinates(city_from), city_coordinates(city_to)
+    if a is None or b is None:
+        return None
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return round(2 * 6371.0 * math.asin(math.sqrt(h)) * ROAD_FACTOR, 1)
+
+def distance_km(address_from, address_to):
+    """Дорожное расстояние между адресами, км (None, если город неизвестен)"""
+    city_from, city_to = city_of(address_from), city_of(address_to)
+    if city_from.casefold() == city_to.casefold():
+        return 0.0 if address_from == address_to else LOCAL_DISTANCE_KM
+    return city_distance_km(city_from, city_to)
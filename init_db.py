@@ -8,9 +8,414 @@ def hash_password(password):
     salt = "LogisticTransSalt2026"
     return hashlib.sha256((password + salt).encode()).hexdigest()
 
-def init_database():
+def table_exists(cursor, name):
+    """Проверка существования таблицы"""
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+def rebuild_zone_aggregates(cursor):
+    """Полный пересчет заполненности складских зон по таблице warehouse"""
+    cursor.execute('''
+        INSERT OR IGNORE INTO warehouse_zones (name)
+        SELECT DISTINCT storage_zone FROM warehouse WHERE storage_zone IS NOT NULL
+    ''')
+    cursor.execute('''
+        UPDATE warehouse_zones SET
+            used_volume = COALESCE((SELECT SUM(volume) FROM warehouse w
+                                    WHERE w.storage_zone = warehouse_zones.name AND w.departure_date IS NULL), 0),
+            item_count = (SELECT COUNT(*) FROM warehouse w
+                          WHERE w.storage_zone = warehouse_zones.name AND w.departure_date IS NULL)
+    ''')
+
+# Столбцы, для которых ведется учет значений фильтров (фасетов)
+FACET_COLUMNS = {
+    'orders': ('status',),
+    'vehicles': ('status',),
+    'routes': ('status',),
+    'warehouse': ('status', 'storage_zone'),
+}
+
+def rebuild_facets(cursor):
+    """Полный пересчет значений и количества записей для фильтров списков"""
+    cursor.execute('DELETE FROM facet_counts')
+    for table, columns in FACET_COLUMNS.items():
+        for column in columns:
+            cursor.execute(f'''
+                INSERT INTO facet_counts (table_name, column_name, value, count)
+                SELECT ?, ?, {column}, COUNT(*) FROM {table}
+                WHERE {column} IS NOT NULL
+                GROUP BY {column}
+            ''', (table, column))
+
+def create_facet_triggers(cursor, table, column):
+    """Триггеры, поддерживающие facet_counts для столбца таблицы"""
+    increment = f'''
+        INSERT OR IGNORE INTO facet_counts (table_name, column_name, value, count)
+        SELECT '{table}', '{column}', NEW.{column}, 0 WHERE NEW.{column} IS NOT NULL;
+        UPDATE facet_counts SET count = count + 1
+        WHERE table_name = '{table}' AND column_name = '{column}' AND value = NEW.{column};
+    '''
+    decrement = f'''
+        UPDATE facet_counts SET count = count - 1
+        WHERE table_name = '{table}' AND column_name = '{column}' AND value = OLD.{column};
+        DELETE FROM facet_counts
+        WHERE table_name = '{table}' AND column_name = '{column}' AND value = OLD.{column} AND count <= 0;
+    '''
+    
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_facet_{table}_{column}_insert AFTER INSERT ON {table}
+    BEGIN {increment} END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_facet_{table}_{column}_update AFTER UPDATE OF {column} ON {table}
+    WHEN OLD.{column} IS NOT NEW.{column}
+    BEGIN {decrement} {increment} END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_facet_{table}_{column}_delete AFTER DELETE ON {table}
+    BEGIN {decrement} END
+    ''')
+
+def add_column(cursor, table, column, definition):
+    """Добавление столбца в существующую таблицу, если его еще нет"""
+    columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def create_tariff_schema(cursor):
+    """Тарифные таблицы для расчета стоимости перевозки и счетчик их версии
+    
+    Любое изменение тарифов увеличивает tariff_version.version, по которому
+    сбрасывается кеш рассчитанных тарифов.
+    """
+    tariffs_existed = table_exists(cursor, 'tariff_weight_bands')
+    
+    # Весовой диапазон применяется к грузам до max_weight тонн включительно
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tariff_weight_bands (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        max_weight REAL NOT NULL UNIQUE CHECK (max_weight > 0),
+        base_price REAL NOT NULL CHECK (base_price >= 0),
+        price_per_km REAL NOT NULL CHECK (price_per_km >= 0)
+    )
+    ''')
+    
+    # Множитель срочности для доставки не позднее чем через max_days дней
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tariff_urgency (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        max_days INTEGER NOT NULL UNIQUE,
+        multiplier REAL NOT NULL CHECK (multiplier > 0)
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS client_discounts (
+        client_id INTEGER PRIMARY KEY,
+        discount_percent REAL NOT NULL CHECK (discount_percent >= 0 AND discount_percent < 100),
+        FOREIGN KEY (client_id) REFERENCES clients(id)
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tariff_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO tariff_version (id, version) VALUES (1, 1)')
+    
+    for table in ('tariff_weight_bands', 'tariff_urgency', 'client_discounts'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+            BEGIN
+                UPDATE tariff_version SET version = version + 1;
+            END
+            ''')
+    
+    if not tariffs_existed:
+        cursor.executemany(
+            'INSERT INTO tariff_weight_bands (max_weight, base_price, price_per_km) VALUES (?, ?, ?)',
+            [(1.5, 2500.0, 15.0), (5.0, 4000.0, 22.0), (10.0, 6000.0, 30.0), (20.0, 9000.0, 40.0), (30.0, 12000.0, 50.0)]
+        )
+        cursor.executemany(
+            'INSERT INTO tariff_urgency (max_days, multiplier) VALUES (?, ?)',
+            [(1, 1.5), (3, 1.25), (7, 1.1)]
+        )
+
+def create_sync_schema(cursor):
+    """Отметки updated_at и журнал изменений sync_log для синхронизации устройств водителей
+    
+    Каждое изменение маршрута, заказа или уведомления записывается в sync_log с id
+    водителя, которому оно адресовано; seq журнала служит курсором синхронизации.
+    """
+    for table, created in (('routes', 'created_at'), ('orders', 'order_date'), ('notifications', 'created_at')):
+        if 'updated_at' not in [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]:
+            add_column(cursor, table, 'updated_at', 'TIMESTAMP')
+            cursor.execute(f'UPDATE {table} SET updated_at = COALESCE({created}, CURRENT_TIMESTAMP)')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        driver_id INTEGER NOT NULL,
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        op TEXT NOT NULL CHECK (op IN ('upsert', 'delete')),
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sync_log_driver ON sync_log(driver_id, seq)')
+    
+    # Маршруты: изменения адресуются водителю маршрута, вместе с маршрутом
+    # водитель получает и его заказ
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_sync_routes_insert AFTER INSERT ON routes
+    BEGIN
+        UPDATE routes SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        INSERT INTO sync_log (driver_id, entity, entity_id, op)
+        SELECT NEW.driver_id, 'routes', NEW.id, 'upsert' WHERE NEW.driver_id IS NOT NULL
+        UNION ALL
+        SELECT NEW.driver_id, 'orders', NEW.order_id, 'upsert' WHERE NEW.driver_id IS NOT NULL;
+    END
+    ''')
+    # При переназначении прежний водитель получает удаление маршрута и его заказа
+    # (триггер пересоздается: прежняя версия не удаляла заказ)
+    cursor.execute('DROP TRIGGER IF EXISTS trg_sync_routes_update')
+    cursor.execute('''
+    CREATE TRIGGER trg_sync_routes_update AFTER UPDATE ON routes
+    WHEN NEW.updated_at IS OLD.updated_at
+    BEGIN
+        UPDATE routes SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        INSERT INTO sync_log (driver_id, entity, entity_id, op)
+        SELECT NEW.driver_id, 'routes', NEW.id, 'upsert' WHERE NEW.driver_id IS NOT NULL
+        UNION ALL
+        SELECT OLD.driver_id, 'routes', OLD.id, 'delete'
+        WHERE OLD.driver_id IS NOT NULL AND OLD.driver_id IS NOT NEW.driver_id
+        UNION ALL
+        SELECT OLD.driver_id, 'orders', OLD.order_id, 'delete'
+        WHERE OLD.driver_id IS NOT NULL AND OLD.driver_id IS NOT NEW.driver_id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_sync_routes_delete AFTER DELETE ON routes
+    WHEN OLD.driver_id IS NOT NULL
+    BEGIN
+        INSERT INTO sync_log (driver_id, entity, entity_id, op)
+        VALUES (OLD.driver_id, 'routes', OLD.id, 'delete'), (OLD.driver_id, 'orders', OLD.order_id, 'delete');
+    END
+    ''')
+    
+    # Заказы: изменения адресуются водителям маршрутов заказа
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_sync_orders_update AFTER UPDATE ON orders
+    WHEN NEW.updated_at IS OLD.updated_at
+    BEGIN
+        UPDATE orders SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        INSERT INTO sync_log (driver_id, entity, entity_id, op)
+        SELECT DISTINCT driver_id, 'orders', NEW.id, 'upsert' FROM routes
+        WHERE order_id = NEW.id AND driver_id IS NOT NULL;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_sync_orders_insert AFTER INSERT ON orders
+    BEGIN
+        UPDATE orders SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+    END
+    ''')
+    
+    # Уведомления: изменения адресуются водителю-получателю
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_sync_notifications_insert AFTER INSERT ON notifications
+    BEGIN
+        UPDATE notifications SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        INSERT INTO sync_log (driver_id, entity, entity_id, op)
+        SELECT id, 'notifications', NEW.id, 'upsert' FROM drivers WHERE user_id = NEW.user_id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_sync_notifications_update AFTER UPDATE ON notifications
+    WHEN NEW.updated_at IS OLD.updated_at
+    BEGIN
+        UPDATE notifications SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        INSERT INTO sync_log (driver_id, entity, entity_id, op)
+        SELECT id, 'notifications', NEW.id, 'upsert' FROM drivers WHERE user_id = NEW.user_id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_sync_notifications_delete AFTER DELETE ON notifications
+    BEGIN
+        INSERT INTO sync_log (driver_id, entity, entity_id, op)
+        SELECT id, 'notifications', OLD.id, 'delete' FROM drivers WHERE user_id = OLD.user_id;
+    END
+    ''')
+
+def create_extended_schema(cursor):
+    """Создание дополнительных таблиц, индексов и триггеров (идемпотентно)"""
+    # Журнал WAL: открытый курсор чтения (потоковая отрисовка списков) не блокирует
+    # запись других соединений. Режим сохраняется в файле БД и меняется только вне транзакции
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
+    # Складские зоны: лимит объема и агрегаты заполненности.
+    # Агрегаты поддерживаются триггерами при поступлении и отгрузке груза
+    # (груз занимает место, пока не заполнена departure_date)
+    zones_existed = table_exists(cursor, 'warehouse_zones')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS warehouse_zones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        capacity_volume REAL CHECK (capacity_volume IS NULL OR capacity_volume >= 0),
+        used_volume REAL NOT NULL DEFAULT 0,
+        item_count INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_warehouse_zone_insert AFTER INSERT ON warehouse
+    WHEN NEW.storage_zone IS NOT NULL
+    BEGIN
+        INSERT OR IGNORE INTO warehouse_zones (name) VALUES (NEW.storage_zone);
+        UPDATE warehouse_zones SET used_volume = used_volume + COALESCE(NEW.volume, 0), item_count = item_count + 1
+        WHERE name = NEW.storage_zone AND NEW.departure_date IS NULL;
+    END
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_warehouse_zone_update
+    AFTER UPDATE OF storage_zone, volume, departure_date ON warehouse
+    BEGIN
+        UPDATE warehouse_zones SET used_volume = used_volume - COALESCE(OLD.volume, 0), item_count = item_count - 1
+        WHERE name = OLD.storage_zone AND OLD.departure_date IS NULL;
+        INSERT OR IGNORE INTO warehouse_zones (name) SELECT NEW.storage_zone WHERE NEW.storage_zone IS NOT NULL;
+        UPDATE warehouse_zones SET used_volume = used_volume + COALESCE(NEW.volume, 0), item_count = item_count + 1
+        WHERE name = NEW.storage_zone AND NEW.departure_date IS NULL;
+    END
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_warehouse_zone_delete AFTER DELETE ON warehouse
+    BEGIN
+        UPDATE warehouse_zones SET used_volume = used_volume - COALESCE(OLD.volume, 0), item_count = item_count - 1
+        WHERE name = OLD.storage_zone AND OLD.departure_date IS NULL;
+    END
+    ''')
+    
+    if not zones_existed:
+        rebuild_zone_aggregates(cursor)
+    
+    # Значения фильтров списков и количество записей по каждому значению
+    facets_existed = table_exists(cursor, 'facet_counts')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS facet_counts (
+        table_name TEXT NOT NULL,
+        column_name TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (table_name, column_name, value)
+    )
+    ''')
+    
+    for table, columns in FACET_COLUMNS.items():
+        for column in columns:
+            create_facet_triggers(cursor, table, column)
+    
+    if not facets_existed:
+        rebuild_facets(cursor)
+    
+    # Покрывающий индекс истории завершенных рейсов для прогноза ТО
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_routes_completed
+        ON routes(status, actual_end_time, vehicle_id, distance_km)
+    ''')
+    
+    # Многоточечные рейсы: маршруты заказов одного рейса ссылаются на trips
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS trips (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vehicle_id INTEGER,
+        driver_id INTEGER,
+        start_point TEXT,
+        total_weight REAL,
+        distance_km REAL,
+        stop_count INTEGER,
+        status TEXT NOT NULL DEFAULT 'Запланирован',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (vehicle_id) REFERENCES vehicles(id),
+        FOREIGN KEY (driver_id) REFERENCES drivers(id)
+    )
+    ''')
+    add_column(cursor, 'routes', 'trip_id', 'INTEGER REFERENCES trips(id)')
+    add_column(cursor, 'routes', 'stop_sequence', 'INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_routes_trip ON routes(trip_id)')
+    
+    # Очередь фоновых задач (время run_after и locked_until - секунды Unix)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL DEFAULT '{}',
+        idempotency_key TEXT UNIQUE,
+        status TEXT NOT NULL DEFAULT 'Ожидает' CHECK (status IN ('Ожидает', 'Выполняется', 'Выполнено', 'Ошибка')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 5,
+        run_after REAL NOT NULL,
+        locked_until REAL,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_after)')
+    
+    create_sync_schema(cursor)
+    
+    # Контроль сроков доставки: частичные индексы по срокам открытых заказов и
+    # маршрутов и отметки об отправленных уведомлениях о просрочке
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_sla ON orders(planned_delivery_date)
+        WHERE status != 'Доставлен'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_routes_sla ON routes(planned_end_time)
+        WHERE status != 'Завершен'
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sla_alerts (
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        deadline TEXT NOT NULL,
+        alerted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (entity, entity_id, deadline)
+    )
+    ''')
+    
+    # Счетчики номеров заказов по дням (ГГГГММДД): следующий незарезервированный номер
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_counters (
+        day TEXT PRIMARY KEY,
+        next_value INTEGER NOT NULL
+    )
+    ''')
+    
+    create_tariff_schema(cursor)
+
+def upgrade_database(db_path='logist_trans.db'):
+    """Обновление схемы существующей БД до текущей версии"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    create_extended_schema(cursor)
+    
+    conn.commit()
+    
+    # Архивная БД (если создана) получает новые столбцы основной схемы
+    from app.archive import upgrade_archive
+    upgrade_archive(conn)
+    
+    conn.close()
+
+def init_database(db_path='logist_trans.db'):
     """Создание таблиц и заполнение начальными данными"""
-    conn = sqlite3.connect('logist_trans.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # Таблица пользователей
@@ -165,6 +570,8 @@ def init_database():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_routes_order ON routes(order_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id)')
     
+    create_extended_schema(cursor)
+    
     # Заполнение начальными данными
     # Пользователи
     users_data = [
@@ -228,6 +635,18 @@ def init_database():
     VALUES (?, ?, ?, ?, ?, ?)''',
         (1, 1, 2, 'Москва, склад №1', 'Санкт-Петербург, ул. Заводская, 5', 'В пути'))
     
+    # Складские зоны
+    zones_data = [
+        ('Зона А', 200.0),
+        ('Зона Б', 500.0),
+        ('Зона В', 300.0),
+    ]
+    
+    cursor.executemany(
+        'INSERT OR IGNORE INTO warehouse_zones (name, capacity_volume) VALUES (?, ?)',
+        zones_data
+    )
+    
     # Склад
     warehouse_data = [
         ('Цемент', 500, 'Зона А', 25.5, 'Зарезервирован', datetime.now(), None, 1),
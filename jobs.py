@@ -0,0 +1,361 @@
+"""Фоновая очередь задач с хранением в таблице jobs (SQLite)"""
+import json
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+# Число попыток выполнения задачи по умолчанию
+MAX_ATTEMPTS = 5
+# Базовая задержка повтора, секунд (удваивается с каждой попыткой)
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 600.0
+# Время, на которое задача скрывается от других исполнителей после захвата, секунд
+VISIBILITY_TIMEOUT = 60.0
+# Пауза опроса пустой очереди, секунд
+POLL_INTERVAL = 0.5
+# Срок хранения выполненных задач, дней
+JOB_RETENTION_DAYS = 7
+# Интервал периодической очистки журнала синхронизации и выполненных задач, секунд
+PRUNE_INTERVAL = 24 * 3600
+
+HANDLERS = {}
+
+_wakeup = threading.Event()
+
+def job_handler(kind, transaction=True, visibility_timeout=None):
+    """Декоратор регистрации обработчика задач вида kind: handler(db, payload)
+
+    При transaction=False обработчик сам управляет транзакциями (например, выполняет ATTACH).
+    visibility_timeout задает время захвата для долгих задач вместо значения исполнителя.
+    """
+    def decorator(f):
+        HANDLERS[kind] = (f, transaction, visibility_timeout)
+        return f
+    return decorator
+
+def enqueue(db, kind, payload=None, idempotency_key=None, delay=0, max_attempts=MAX_ATTEMPTS):
+    """Постановка задачи в очередь в текущей транзакции db
+
+    Задача становится видна исполнителям только после фиксации транзакции вызывающим
+    кодом. Повторная постановка с тем же idempotency_key игнорируется. Возвращает
+    id задачи или None для дубликата.
+    """
+    cursor = db.execute('''
+        INSERT OR IGNORE INTO jobs (kind, payload, idempotency_key, status, run_after, max_attempts)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (kind, json.dumps(payload or {}, ensure_ascii=False), idempotency_key, 'Ожидает',
+          time.time() + delay, max_attempts))
+    _wakeup.set()
+    return cursor.lastrowid if cursor.rowcount else None
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка повтора со случайным разбросом"""
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+def queue_depth(db):
+    """Количество задач по статусам и возраст самой старой ожидающей задачи"""
+    depth = {row[0]: row[1] for row in db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')}
+    oldest = db.execute("SELECT MIN(run_after) FROM jobs WHERE status = 'Ожидает'").fetchone()[0]
+    return {'by_status': depth, 'oldest_pending_age': round(max(time.time() - oldest, 0), 1) if oldest else 0}
+
+def prune_jobs(db, days=JOB_RETENTION_DAYS):
+    """Удаление выполненных задач, завершенных больше days дней назад"""
+    db.execute("DELETE FROM jobs WHERE status = 'Выполнено' AND finished_at < datetime('now', ?)",
+               (f'-{days} days',))
+
+def schedule_prune(db, delay=0):
+    """Постановка периодической очистки журналов в очередь в текущей транзакции db
+
+    Ключ идемпотентности - дата запуска, поэтому при нескольких процессах и
+    перезапусках очистка ставится не чаще раза в сутки.
+    """
+    run_at = datetime.fromtimestamp(time.time() + delay)
+    return enqueue(db, 'prune_logs', None, f'prune-logs-{run_at:%Y%m%d}', delay)
+
+class JobQueue:
+    """Пул потоков-исполнителей задач из таблицы jobs
+
+    Захват задачи выполняется в транзакции BEGIN IMMEDIATE, поэтому несколько
+    исполнителей (в том числе в разных процессах) не получают одну задачу дважды.
+    Задача, исполнитель которой не завершил ее за время захвата (VISIBILITY_TIMEOUT
+    или значение обработчика), снова становится доступна, пока не исчерпаны попытки.
+    Изменения обработчика и отметка о выполнении фиксируются одной транзакцией.
+    """
+
+    def __init__(self, db_path, workers=2, visibility_timeout=VISIBILITY_TIMEOUT, poll_interval=POLL_INTERVAL):
+        self.db_path = db_path
+        self.workers = workers
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._completed = deque(maxlen=10_000)
+        self.started_at = None
+        self.stats = {'processed': 0, 'failed': 0, 'retried': 0, 'expired': 0}
+
+    def start(self):
+        """Запуск потоков-исполнителей"""
+        self.started_at = time.time()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Остановка исполнителей после завершения текущих задач"""
+        self._stopping.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def metrics(self, db):
+        """Пропускная способность исполнителей и глубина очереди"""
+        now = time.time()
+        with self._lock:
+            stats = dict(self.stats)
+            recent = sum(1 for finished in self._completed if finished > now - 60)
+        uptime = now - self.started_at if self.started_at else 0
+        return {
+            **stats,
+            'workers': len(self._threads),
+            'uptime': round(uptime, 1),
+            'throughput_per_sec': round(stats['processed'] / uptime, 2) if uptime else 0,
+            'throughput_last_minute': recent,
+            'queue': queue_depth(db),
+        }
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _find_ready(self, db, now):
+        """Готовая задача: ожидающая или с истекшим временем захвата"""
+        return db.execute('''
+            SELECT id, kind, payload, attempts, max_attempts FROM jobs
+            WHERE status = 'Ожидает' AND run_after <= ?
+            ORDER BY run_after LIMIT 1
+        ''', (now,)).fetchone() or db.execute('''
+            SELECT id, kind, payload, attempts, max_attempts FROM jobs
+            WHERE status = 'Выполняется' AND locked_until < ?
+            LIMIT 1
+        ''', (now,)).fetchone()
+
+    def _claim(self, db, check_first=True):
+        """Захват готовой задачи: ожидающей или с истекшим временем захвата
+
+        Опрос пустой очереди выполняется обычным чтением без блокировки записи;
+        BEGIN IMMEDIATE берется, только когда готовая задача есть, и задача
+        выбирается заново, так как ее мог захватить другой исполнитель. При
+        check_first=False (сигнал enqueue) проверка пропускается: задача еще может
+        быть не зафиксирована, и BEGIN IMMEDIATE дожидается фиксации транзакции,
+        поставившей ее в очередь.
+        """
+        now = time.time()
+        if check_first and not self._find_ready(db, now):
+            return None
+
+        db.execute('BEGIN IMMEDIATE')
+        job = self._find_ready(db, now)
+
+        if job and job['attempts'] >= job['max_attempts']:
+            # Время захвата истекло на последней попытке: задача каждый раз выполняется
+            # дольше допустимого или завершает исполнителя, поэтому больше не повторяется
+            db.execute('''
+                UPDATE jobs SET status = 'Ошибка', last_error = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', ('Истекло время захвата на последней попытке', job['id']))
+            with self._lock:
+                self.stats['failed'] += 1
+            job = None
+        elif job:
+            lease = HANDLERS[job['kind']][2] if job['kind'] in HANDLERS else None
+            db.execute('''
+                UPDATE jobs SET status = 'Выполняется', attempts = attempts + 1, locked_until = ?
+                WHERE id = ?
+            ''', (now + (lease or self.visibility_timeout), job['id']))
+        db.commit()
+        return job
+
+    def _execute(self, db, job):
+        attempts = job['attempts'] + 1
+        try:
+            if job['kind'] not in HANDLERS:
+                raise LookupError(f'Нет обработчика задач вида {job["kind"]}')
+
+            handler, transaction, _ = HANDLERS[job['kind']]
+            if transaction:
+                db.execute('BEGIN IMMEDIATE')
+            handler(db, json.loads(job['payload']))
+
+            # Отметка о выполнении фиксируется вместе с изменениями обработчика;
+            # если задачу после таймаута захватил другой исполнитель, изменения откатываются
+            cursor = db.execute('''
+                UPDATE jobs SET status = 'Выполнено', finished_at = CURRENT_TIMESTAMP, last_error = NULL
+                WHERE id = ? AND attempts = ? AND status = 'Выполняется'
+            ''', (job['id'], attempts))
+            if cursor.rowcount == 0:
+                # Время захвата истекло, и задачу забрал другой исполнитель
+                db.rollback()
+                with self._lock:
+                    self.stats['expired'] += 1
+                return
+            db.commit()
+            with self._lock:
+                self.stats['processed'] += 1
+                self._completed.append(time.time())
+
+        except Exception:
+            db.rollback()
+            error = traceback.format_exc(limit=5)
+            if attempts >= job['max_attempts']:
+                db.execute('''
+                    UPDATE jobs SET status = 'Ошибка', last_error = ?, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND attempts = ?
+                ''', (error, job['id'], attempts))
+                stat = 'failed'
+            else:
+                db.execute('''
+                    UPDATE jobs SET status = 'Ожидает', last_error = ?, run_after = ?, locked_until = NULL
+                    WHERE id = ? AND attempts = ?
+                ''', (error, time.time() + retry_delay(attempts), job['id'], attempts))
+                stat = 'retried'
+            db.commit()
+            with self._lock:
+                self.stats[stat] += 1
+
+    def _run(self):
+        db = self._connect()
+        woken = False
+        try:
+            while not self._stopping.is_set():
+                try:
+                    job = self._claim(db, check_first=not woken)
+                    if job:
+                        self._execute(db, job)
+                except sqlite3.Error:
+                    # БД занята: незавершенная задача вернется в очередь по таймауту захвата
+                    db.rollback()
+                    job = None
+
+                woken = False
+                if not job:
+                    woken = _wakeup.wait(self.poll_interval)
+                    _wakeup.clear()
+        finally:
+            db.close()
+
+def init_app(app, db_path='logist_trans.db'):
+    """Запуск исполнителей очереди для приложения (JOB_WORKERS = 0 отключает их)"""
+    workers = app.config.get('JOB_WORKERS', 2)
+    if workers:
+        queue = JobQueue(db_path, workers)
+        queue.start()
+        app.extensions['job_queue'] = queue
+        
+        # Запуск цепочки периодической очистки (задача ставит в очередь следующую)
+        db = sqlite3.connect(db_path, timeout=30)
+        try:
+            schedule_prune(db)
+            db.commit()
+        finally:
+            db.close()
+
+# ============ ОБРАБОТЧИКИ ЗАДАЧ ============
+@job_handler('notify_driver_route')
+def notify_driver_route(db, payload):
+    """Уведомление водителя о назначенном маршруте или многоточечном рейсе"""
+    if payload.get('trip_id'):
+        trip = db.execute('''
+            SELECT t.id, t.stop_count, d.user_id, MIN(r.order_id) AS order_id
+            FROM trips t
+            JOIN drivers d ON t.driver_id = d.id
+            JOIN routes r ON r.trip_id = t.id
+            WHERE t.id = ?
+        ''', (payload['trip_id'],)).fetchone()
+        if trip and trip['user_id']:
+            db.execute('INSERT INTO notifications (user_id, message, type, order_id) VALUES (?, ?, ?, ?)',
+                       (trip['user_id'], f'Вам назначен рейс №{trip["id"]} ({trip["stop_count"]} точек)',
+                        'Назначение маршрута', trip['order_id']))
+        return
+
+    route = db.execute('''
+        SELECT r.id, r.order_id, d.user_id
+        FROM routes r
+        JOIN drivers d ON r.driver_id = d.id
+        WHERE r.id = ?
+    ''', (payload['route_id'],)).fetchone()
+    if route and route['user_id']:
+        db.execute('INSERT INTO notifications (user_id, message, type, order_id) VALUES (?, ?, ?, ?)',
+                   (route['user_id'], f'Вам назначен маршрут №{route["id"]}', 'Назначение маршрута', route['order_id']))
+
+@job_handler('refresh_aggregates')
+def refresh_aggregates(db, payload):
+    """Полный пересчет агрегатов складских зон и значений фильтров"""
+    from app.init_db import rebuild_facets, rebuild_zone_aggregates
+
+    cursor = db.cursor()
+    rebuild_zone_aggregates(cursor)
+    rebuild_facets(cursor)
+
+# Перенос большого числа заказов может длиться дольше VISIBILITY_TIMEOUT
+@job_handler('archive_orders', transaction=False, visibility_timeout=3600)
+def archive_delivered_orders(db, payload):
+    """Перенос доставленных заказов в архивную БД"""
+    from app.archive import ARCHIVE_AFTER_DAYS, archive_orders
+
+    archive_orders(db, payload.get('days', ARCHIVE_AFTER_DAYS))
+
+@job_handler('prune_logs')
+def prune_logs(db, payload):
+    """Периодическая очистка журнала синхронизации и выполненных задач"""
+    from app.sync import prune_sync_log
+
+    prune_sync_log(db)
+    prune_jobs(db)
+    schedule_prune(db, PRUNE_INTERVAL)
+
+if __name__ == '__main__':
+    # Бенчмарк пропускной способности: python -m app.jobs
+    import os
+    import tempfile
+
+    from app.init_db import init_database
+
+    jobs_count, workers = 5_000, 4
+
+    @job_handler('noop')
+    def noop(db, payload):
+        db.execute('UPDATE jobs SET last_error = NULL WHERE id = ?', (payload['n'],))
+
+    path = os.path.join(tempfile.mkdtemp(), 'jobs_bench.db')
+    init_database(path)
+
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    started = time.perf_counter()
+    for n in range(jobs_count):
+        enqueue(db, 'noop', {'n': n}, idempotency_key=f'noop-{n}')
+    enqueue(db, 'noop', {'n': 0}, idempotency_key='noop-0')  # дубликат игнорируется
+    db.commit()
+    print(f'Постановка {jobs_count} задач: {time.perf_counter() - started:.2f} с')
+
+    queue = JobQueue(path, workers, poll_interval=0.05)
+    started = time.perf_counter()
+    queue.start()
+    while queue_depth(db)['by_status'].get('Ожидает'):
+        time.sleep(0.2)
+    queue.stop()
+    elapsed = time.perf_counter() - started
+
+    metrics = queue.metrics(db)
+    print(f'Исполнителей: {workers}, выполнено: {metrics["processed"]}, '
+          f'{metrics["processed"] / elapsed:.0f} задач/с, очередь: {metrics["queue"]["by_status"]}')
+    db.close()
@@ -0,0 +1,123 @@
+"""Прогноз технического обслуживания автопарка по пробегу"""
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Окно истории завершенных рейсов для оценки среднесуточного пробега
+HISTORY_DAYS = 90
+# Порог "скоро на ТО" по умолчанию, дней
+DUE_SOON_DAYS = 7
+# Время жизни закешированного прогноза, секунд
+FORECAST_MAX_AGE = 300
+
+_cache = {'forecast': None, 'computed_at': 0.0}
+_cache_lock = threading.Lock()
+
+def project_maintenance(mileage, next_maintenance_km, daily_km):
+    """Векторный расчет: остаток пробега до ТО и число дней до его достижения
+
+    Для ТС без заданного порога (next_maintenance_km < 0) и без пробега за окно
+    истории срок бесконечен; ТС, уже превысившие порог, получают 0 дней.
+    """
+    remaining_km = next_maintenance_km - mileage
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days = np.where(remaining_km <= 0, 0.0, remaining_km / daily_km)
+    days[next_maintenance_km < 0] = np.inf
+    return remaining_km, days
+
+def load_array(cursor, width):
+    """Результат запроса из числовых столбцов в виде двумерного массива float64"""
+    rows = cursor.fetchall()
+    values = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64, count=len(rows) * width)
+    return values.reshape(-1, width)
+
+def forecast_fleet(db, history_days=HISTORY_DAYS):
+    """Прогноз ТО для всего автопарка за один векторный проход
+
+    Возвращает словарь массивов, упорядоченных по id ТС: id, remaining_km, daily_km, days.
+    """
+    cursor = db.cursor()
+    cursor.row_factory = None
+
+    fleet = load_array(cursor.execute('''
+        SELECT id, COALESCE(current_mileage, 0), COALESCE(next_maintenance_km, -1)
+        FROM vehicles
+        ORDER BY id
+    '''), 3)
+    ids = fleet[:, 0].astype(np.int64)
+
+    # Покрывается индексом idx_routes_completed, таблица routes не читается
+    history = load_array(cursor.execute('''
+        SELECT vehicle_id, distance_km
+        FROM routes
+        WHERE status = 'Завершен' AND actual_end_time >= ?
+          AND vehicle_id IS NOT NULL AND distance_km IS NOT NULL
+    ''', (datetime.now() - timedelta(days=history_days),)), 2)
+
+    # Суммарный пробег каждого ТС за окно истории
+    positions = np.searchsorted(ids, history[:, 0].astype(np.int64))
+    known = positions < len(ids)
+    known[known] = ids[positions[known]] == history[known, 0]
+    daily_km = np.bincount(positions[known], weights=history[known, 1], minlength=len(ids)) / history_days
+
+    remaining_km, days = project_maintenance(fleet[:, 1], fleet[:, 2], daily_km)
+
+    return {'id': ids, 'remaining_km': remaining_km, 'daily_km': daily_km, 'days': days}
+
+def get_forecast(db, max_age=FORECAST_MAX_AGE):
+    """Закешированный прогноз автопарка, пересчитываемый не чаще раза в max_age секунд"""
+    with _cache_lock:
+        if _cache['forecast'] is None or time.monotonic() - _cache['computed_at'] > max_age:
+            _cache['forecast'] = forecast_fleet(db)
+            _cache['computed_at'] = time.monotonic()
+        return _cache['forecast']
+
+def days_to_maintenance(forecast, vehicle_ids):
+    """Дни до ТО для указанных ТС (None, если ТС нет в прогнозе или срок не определен)"""
+    ids = forecast['id']
+    lookup = np.asarray(vehicle_ids, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(ids, lookup), max(len(ids) - 1, 0))
+
+    result = []
+    for vehicle_id, position in zip(lookup, positions):
+        if len(ids) and ids[position] == vehicle_id and np.isfinite(forecast['days'][position]):
+            result.append(round(float(forecast['days'][position]), 1))
+        else:
+            result.append(None)
+    return result
+
+if __name__ == '__main__':
+    # Бенчмарк на сгенерированном автопарке: python -m app.maintenance
+    import sqlite3
+
+    fleet_size, routes_count = 100_000, 1_000_000
+    rng = np.random.default_rng(0)
+
+    db = sqlite3.connect(':memory:')
+    db.execute('''CREATE TABLE vehicles (id INTEGER PRIMARY KEY, current_mileage INTEGER,
+                  next_maintenance_km INTEGER)''')
+    db.execute('''CREATE TABLE routes (id INTEGER PRIMARY KEY, vehicle_id INTEGER, status TEXT,
+                  actual_end_time TIMESTAMP, distance_km REAL)''')
+    db.execute('CREATE INDEX idx_routes_completed ON routes(status, actual_end_time, vehicle_id, distance_km)')
+
+    mileage = rng.integers(0, 500_000, fleet_size)
+    db.executemany('INSERT INTO vehicles VALUES (?, ?, ?)',
+                   ((i + 1, int(m), int(m + rng.integers(-2_000, 30_000))) for i, m in enumerate(mileage)))
+    now = datetime.now()
+    db.executemany('INSERT INTO routes VALUES (?, ?, ?, ?, ?)',
+                   ((i + 1, int(v), 'Завершен', now - timedelta(days=int(d)), float(km))
+                    for i, (v, d, km) in enumerate(zip(rng.integers(1, fleet_size + 1, routes_count),
+                                                       rng.integers(0, 180, routes_count),
+                                                       rng.uniform(50, 1500, routes_count)))))
+    db.commit()
+
+    started = time.perf_counter()
+    forecast = forecast_fleet(db)
+    elapsed = time.perf_counter() - started
+
+    due = int(np.count_nonzero(forecast['days'] <= DUE_SOON_DAYS))
+    print(f'ТС: {fleet_size}, рейсов: {routes_count}, прогноз: {elapsed * 1000:.0f} мс, '
+          f'на ТО в ближайшие {DUE_SOON_DAYS} дн.: {due}')
@@ -0,0 +1,74 @@
+"""Размещение грузов по складским зонам (best-fit по свободному объему)"""
+import bisect
+from datetime import datetime
+
+def load_free_zones(db):
+    """Свободный объем зон с заданным лимитом: отсортированный список (free_volume, name)
+
+    Читает только агрегаты warehouse_zones, т.е. O(число зон), а не O(число грузов).
+    """
+    rows = db.execute('''
+        SELECT name, capacity_volume - used_volume AS free_volume
+        FROM warehouse_zones
+        WHERE capacity_volume IS NOT NULL
+    ''').fetchall()
+    return sorted((row['free_volume'], row['name']) for row in rows)
+
+def zones_without_capacity(db):
+    """Имена зон без лимита объема: в размещении они не участвуют"""
+    return [row['name'] for row in db.execute(
+        'SELECT name FROM warehouse_zones WHERE capacity_volume IS NULL ORDER BY name')]
+
+def best_fit(free_zones, volume):
+    """Индекс зоны с наименьшим свободным объемом, достаточным для партии, или None"""
+    index = bisect.bisect_left(free_zones, (volume, ''))
+    return index if index < len(free_zones) else None
+
+def allocate(free_zones, volumes):
+    """Распределение партий по зонам (best-fit decreasing)
+
+    Партии обрабатываются по убыванию объема, каждая занимает самую плотную из
+    подходящих зон. free_zones изменяется на месте. Возвращает имена зон в
+    исходном порядке партий (None, если партия никуда не помещается).
+    """
+    zones = [None] * len(volumes)
+    for i in sorted(range(len(volumes)), key=lambda i: volumes[i], reverse=True):
+        index = best_fit(free_zones, volumes[i])
+        if index is None:
+            continue
+        free_volume, name = free_zones.pop(index)
+        bisect.insort(free_zones, (free_volume - volumes[i], name))
+        zones[i] = name
+    return zones
+
+def putaway(db, items, dry_run=False):
+    """Размещение входящих партий на складе
+
+    items: список словарей с ключами cargo_name, quantity, volume и необязательным order_id.
+    Подбор зон и вставка выполняются в одной транзакции (BEGIN IMMEDIATE), чтобы
+    параллельные размещения не превысили лимит зоны. Фиксацию выполняет вызывающий код.
+    """
+    volumes = []
+    for item in items:
+        volume = item.get('volume')
+        if not item.get('cargo_name') or not isinstance(item.get('quantity'), int) \
+                or not isinstance(volume, (int, float)) or volume < 0:
+            raise ValueError('Некорректные данные партии')
+        volumes.append(float(volume))
+
+    db.execute('BEGIN IMMEDIATE')
+    zones = allocate(load_free_zones(db), volumes)
+
+    results = []
+    for item, zone in zip(items, zones):
+        result = {'cargo_name': item['cargo_name'], 'volume': item['volume'], 'storage_zone': zone}
+        if zone and not dry_run:
+            cursor = db.execute('''
+                INSERT INTO warehouse (cargo_name, quantity, storage_zone, volume, status, arrival_date, order_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (item['cargo_name'], item['quantity'], zone, item['volume'], 'На складе',
+                  datetime.now(), item.get('order_id')))
+            result['id'] = cursor.lastrowid
+        results.append(result)
+
+    return results
@@ -1,10 +1,23 @@
 """Маршруты приложения Логист-Транс"""
-from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, flash, Response, current_app
 import sqlite3
 import hashlib
 from datetime import datetime, timedelta
 from functools import wraps
-import uuid
+import json
+import numpy as np
+from app.archive import ARCHIVE_AFTER_DAYS, attach_archive
+from app.compact import COLUMNAR_MIMETYPE, COMPRESS_MIN_SIZE, compress, encode_columnar
+from app.consolidation import consolidate
+from app.facets import get_facets
+from app.geo import distance_km
+from app.jobs import enqueue, queue_depth
+from app.maintenance import DUE_SOON_DAYS, days_to_maintenance, get_forecast
+from app.order_numbers import next_order_number
+from app.putaway import putaway, zones_without_capacity
+from app.streaming import RowStream, stream_page
+from app.sync import changes_since
+from app.tariffs import QUOTE_BATCH_LIMIT, quote_order, quote_orders
 
 # Blueprints
 auth_bp = Blueprint('auth', __name__)
@@ -56,6 +69,120 @@ def role_required(*roles):
         return decorated_function
     return decorator
 
+def wants_columnar():
+    """Клиент запросил колоночный формат списка (?format=columnar или заголовок Accept)"""
+    return request.args.get('format') == 'columnar' or COLUMNAR_MIMETYPE in request.accept_mimetypes.values()
+
+def list_response(columns, rows):
+    """Ответ API со списком строк: массив объектов или колоночный JSON"""
+    if wants_columnar():
+        return Response(encode_columnar(columns, rows), mimetype=COLUMNAR_MIMETYPE)
+    return jsonify([dict(zip(columns, row)) for row in rows])
+
+def cursor_response(cursor):
+    """Ответ API со строками курсора; для колоночного формата строки читаются кортежами"""
+    if wants_columnar():
+        cursor.row_factory = None
+    return list_response([d[0] for d in cursor.description], cursor.fetchall())
+
+def parse_delivery_date(value):
+    """Плановая дата доставки из строки ГГГГ-ММ-ДД (ValueError для некорректной)"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date().isoformat()
+    except (TypeError, ValueError):
+        raise ValueError('Некорректная дата доставки (ожидается ГГГГ-ММ-ДД)')
+
+def watch_deadline(entity, entity_id, deadline):
+    """Передача нового срока заказа ('orders') или маршрута ('routes') монитору сроков"""
+    monitor = current_app.extensions.get('sla_monitor')
+    if monitor:
+        monitor.watch(entity, entity_id, deadline)
+
+def record_status_change(db, order_id, old_status, new_status, user_id, notes='Статус изменен'):
+    """Запись смены статуса заказа в историю и каскадное обновление связанных данных"""
+    db.execute('''
+        INSERT INTO order_status_history (order_id, old_status, new_status, changed_by_id, notes)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (order_id, old_status, new_status, user_id, notes))
+    
+    # Если заказ доставлен, освобождаем транспорт и водителя
+    if new_status == 'Доставлен':
+        route = db.execute('SELECT * FROM routes WHERE order_id = ?', (order_id,)).fetchone()
+        if route:
+            db.execute('UPDATE routes SET status = ? WHERE order_id = ?', ('Завершен', order_id))
+            release_resources(db, route)
+
+def release_resources(db, route):
+    """Освобождение транспорта и водителя завершенного маршрута
+    
+    Для маршрута многоточечного рейса ресурсы освобождаются после завершения последней точки.
+    """
+    if route['trip_id']:
+        remaining = db.execute("SELECT COUNT(*) as count FROM routes WHERE trip_id = ? AND status != 'Завершен'",
+                               (route['trip_id'],)).fetchone()['count']
+        if remaining:
+            return
+        db.execute('UPDATE trips SET status = ? WHERE id = ?', ('Завершен', route['trip_id']))
+    
+    db.execute('UPDATE vehicles SET status = ? WHERE id = ?', ('Свободен', route['vehicle_id']))
+    db.execute('UPDATE drivers SET is_available = ? WHERE id = ?', (1, route['driver_id']))
+
+def assign_route(db, order_id, driver_id, vehicle_id, start_point, end_point):
+    """Создание маршрута для заказа с назначением транспорта и водителя"""
+    cursor = db.execute('''
+        INSERT INTO routes (order_id, driver_id, vehicle_id, start_point, end_point, status, distance_km)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (order_id, driver_id, vehicle_id, start_point, end_point, 'Запланирован', distance_km(start_point, end_point)))
+    
+    route_id = cursor.lastrowid
+    
+    # Обновление статуса транспорта и водителя
+    db.execute('UPDATE vehicles SET status = ? WHERE id = ?', ('Назначен', vehicle_id))
+    db.execute('UPDATE drivers SET is_available = ? WHERE id = ?', (0, driver_id))
+    db.execute('UPDATE orders SET status = ? WHERE id = ?', ('Назначен', order_id))
+    
+    # Уведомление водителя отправляется фоновой задачей после фиксации транзакции
+    enqueue(db, 'notify_driver_route', {'route_id': route_id}, f'notify-route-{route_id}')
+    
+    return route_id
+
+def start_route(db, route_id):
+    """Начало движения по маршруту
+    
+    Начать можно только запланированный маршрут; для маршрута в пути или
+    завершенного возвращает False.
+    """
+    cursor = db.execute('UPDATE routes SET status = ?, actual_start_time = ? WHERE id = ? AND status = ?',
+                        ('В пути', datetime.now(), route_id, 'Запланирован'))
+    if cursor.rowcount != 1:
+        return False
+    
+    db.execute('''
+        UPDATE trips SET status = ? WHERE id = (SELECT trip_id FROM routes WHERE id = ?) AND status = ?
+    ''', ('В пути', route_id, 'Запланирован'))
+    return True
+
+def complete_route(db, route):
+    """Завершение маршрута: доставка заказа и освобождение транспорта и водителя
+    
+    Возвращает False, если маршрут уже завершен: повторное завершение не учитывает
+    пробег и не освобождает ресурсы второй раз.
+    """
+    cursor = db.execute('UPDATE routes SET status = ?, actual_end_time = ? WHERE id = ? AND status != ?',
+                        ('Завершен', datetime.now(), route['id'], 'Завершен'))
+    if cursor.rowcount != 1:
+        return False
+    
+    # Обновить статус заказа
+    db.execute('UPDATE orders SET status = ?, actual_delivery_date = ? WHERE id = ?',
+              ('Доставлен', datetime.now().date(), route['order_id']))
+    
+    # Учесть пробег, освободить транспорт и водителя
+    db.execute('UPDATE vehicles SET current_mileage = COALESCE(current_mileage, 0) + ? WHERE id = ?',
+              (route['distance_km'] or 0, route['vehicle_id']))
+    release_resources(db, route)
+    return True
+
 # ============ АУТЕНТИФИКАЦИЯ ============
 @auth_bp.route('/')
 def index():
@@ -194,16 +321,48 @@ def reports():
     ''').fetchall()
     
     # Статистика по транспорту
-    vehicle_stats = db.execute('''
-        SELECT status, COUNT(*) as count
-        FROM vehicles
-        GROUP BY status
-    ''').fetchall()
+    vehicle_stats = get_facets(db, 'vehicles', 'status')
     
     db.close()
     
     return render_template('admin/reports.html', order_stats=order_stats, vehicle_stats=vehicle_stats)
 
+@admin_bp.route('/archive', methods=['POST'])
+@role_required('Администратор')
+def archive():
+    """Перенос доставленных заказов в архивную БД (фоновой задачей)"""
+    days = request.form.get('days', type=int, default=ARCHIVE_AFTER_DAYS)
+    
+    db = get_db()
+    enqueue(db, 'archive_orders', {'days': days}, f'archive-{datetime.now():%Y%m%d%H%M}')
+    db.commit()
+    db.close()
+    
+    flash('Архивирование запущено', 'info')
+    return redirect(url_for('admin.reports'))
+
+@admin_bp.route('/jobs')
+@role_required('Администратор')
+def jobs():
+    """Метрики фоновой очереди задач"""
+    db = get_db()
+    queue = current_app.extensions.get('job_queue')
+    metrics = queue.metrics(db) if queue else {'workers': 0, 'queue': queue_depth(db)}
+    db.close()
+    
+    return jsonify(metrics)
+
+@admin_bp.route('/jobs/refresh-aggregates', methods=['POST'])
+@role_required('Администратор')
+def refresh_aggregates():
+    """Постановка пересчета агрегатов склада и фильтров в очередь"""
+    db = get_db()
+    enqueue(db, 'refresh_aggregates', idempotency_key=f'refresh-aggregates-{datetime.now():%Y%m%d%H%M}')
+    db.commit()
+    db.close()
+    
+    return jsonify({'success': True, 'message': 'Пересчет запланирован'})
+
 # ============ ЛОГИСТ ============
 @logistic_bp.route('/dashboard')
 @role_required('Логист', 'Администратор')
@@ -239,11 +398,18 @@ def orders():
     
     status_filter = request.args.get('status', '')
     search = request.args.get('search', '')
+    include_archive = request.args.get('archive', type=int, default=0)
     
-    query = '''
+    # Архивные заказы показываются только по запросу
+    source = 'orders'
+    if include_archive and attach_archive(db):
+        columns = 'id, order_number, client_id, status, cost, weight, planned_delivery_date, order_date, cargo_description'
+        source = f'(SELECT {columns} FROM main.orders UNION ALL SELECT {columns} FROM archive.orders)'
+    
+    query = f'''
         SELECT o.id, o.order_number, c.name, o.status, o.cost, o.weight, 
                o.planned_delivery_date, o.order_date
-        FROM orders o
+        FROM {source} o
         JOIN clients c ON o.client_id = c.id
         WHERE 1=1
     '''
@@ -261,11 +427,12 @@ def orders():
     query += ' ORDER BY o.order_date DESC'
     
     orders_list = db.execute(query, params).fetchall()
-    statuses = db.execute('SELECT DISTINCT status FROM orders').fetchall()
+    statuses = get_facets(db, 'orders', 'status')
     
     db.close()
     
-    return render_template('logistic/orders.html', orders=orders_list, statuses=statuses, current_status=status_filter, search=search)
+    return render_template('logistic/orders.html', orders=orders_list, statuses=statuses, current_status=status_filter, search=search,
+                           include_archive=include_archive)
 
 @logistic_bp.route('/orders/create', methods=['GET', 'POST'])
 @role_required('Логист', 'Администратор')
@@ -285,9 +452,18 @@ def create_order():
         vehicle_id = request.form.get('vehicle_id')
         driver_id = request.form.get('driver_id')
         
-        order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:6].upper()}"
-        
         try:
+            # Стоимость по тарифам, если логист не указал ее вручную; без веса
+            # расчет занизил бы стоимость до самого легкого диапазона
+            if not cost and not (weight or '').strip():
+                cost = None
+                flash('Стоимость не рассчитана: не указан вес груза', 'warning')
+            elif not cost:
+                quote = quote_order(db, {'client_id': client_id, 'weight': weight, 'address_from': address_from,
+                                         'address_to': address_to, 'planned_delivery_date': planned_delivery_date})
+                cost = quote['cost'] if quote else None
+            
+            order_number = next_order_number()
             cursor = db.cursor()
             cursor.execute('''
                 INSERT INTO orders 
@@ -301,15 +477,7 @@ def create_order():
             
             # Создание маршрута, если указан транспорт
             if vehicle_id and driver_id:
-                cursor.execute('''
-                    INSERT INTO routes (order_id, driver_id, vehicle_id, start_point, end_point, status)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (order_id, driver_id, vehicle_id, address_from, address_to, 'Запланирован'))
-                
-                # Обновление статуса транспорта и водителя
-                cursor.execute('UPDATE vehicles SET status = ? WHERE id = ?', ('Назначен', vehicle_id))
-                cursor.execute('UPDATE drivers SET is_available = ? WHERE id = ?', (0, driver_id))
-                cursor.execute('UPDATE orders SET status = ? WHERE id = ?', ('Назначен', order_id))
+                assign_route(db, order_id, driver_id, vehicle_id, address_from, address_to)
             
             # Запись в историю
             cursor.execute('''
@@ -318,6 +486,7 @@ def create_order():
             ''', (order_id, 'Создан', session['user_id'], 'Заказ создан'))
             
             db.commit()
+            watch_deadline('orders', order_id, planned_delivery_date)
             flash(f'Заказ {order_number} успешно создан', 'success')
             return redirect(url_for('logistic.orders'))
         
@@ -349,29 +518,26 @@ def edit_order(order_id):
         status = request.form.get('status')
         cost = request.form.get('cost')
         notes = request.form.get('notes')
+        planned_delivery_date = (request.form.get('planned_delivery_date') or '').strip()
         
         old_status = order['status']
         
         try:
+            # Пустое поле оставляет срок без изменений
+            if not planned_delivery_date or planned_delivery_date == order['planned_delivery_date']:
+                planned_delivery_date = order['planned_delivery_date']
+            else:
+                planned_delivery_date = parse_delivery_date(planned_delivery_date)
+            
             db.execute('''
-                UPDATE orders SET status = ?, cost = ?, notes = ? WHERE id = ?
-            ''', (status, cost, notes, order_id))
+                UPDATE orders SET status = ?, cost = ?, notes = ?, planned_delivery_date = ? WHERE id = ?
+            ''', (status, cost, notes, planned_delivery_date, order_id))
             
             if old_status != status:
-                db.execute('''
-                    INSERT INTO order_status_history (order_id, old_status, new_status, changed_by_id, notes)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (order_id, old_status, status, session['user_id'], 'Статус изменен'))
-                
-                # Если заказ доставлен, освобождаем транспорт и водителя
-                if status == 'Доставлен':
-                    route = db.execute('SELECT driver_id, vehicle_id FROM routes WHERE order_id = ?', (order_id,)).fetchone()
-                    if route:
-                        db.execute('UPDATE vehicles SET status = ? WHERE id = ?', ('Свободен', route['vehicle_id']))
-                        db.execute('UPDATE drivers SET is_available = ? WHERE id = ?', (1, route['driver_id']))
-                        db.execute('UPDATE routes SET status = ? WHERE order_id = ?', ('Завершен', order_id))
+                record_status_change(db, order_id, old_status, status, session['user_id'])
             
             db.commit()
+            watch_deadline('orders', order_id, planned_delivery_date)
             flash('Заказ обновлен', 'success')
             return redirect(url_for('logistic.orders'))
         
@@ -400,9 +566,14 @@ def vehicles():
     
     query += ' ORDER BY brand, model'
     
-    vehicles_list = db.execute(query, params).fetchall()
-    statuses = db.execute('SELECT DISTINCT status FROM vehicles').fetchall()
+    cursor = db.execute(query, params)
+    statuses = get_facets(db, 'vehicles', 'status')
+    
+    if current_app.config.get('STREAM_LIST_PAGES'):
+        return stream_page('logistic/vehicles.html', db, vehicles=RowStream(cursor), statuses=statuses,
+                           current_status=status_filter)
     
+    vehicles_list = cursor.fetchall()
     db.close()
     
     return render_template('logistic/vehicles.html', vehicles=vehicles_list, statuses=statuses, current_status=status_filter)
@@ -433,7 +604,7 @@ def routes():
     query += ' ORDER BY r.planned_start_time DESC'
     
     routes_list = db.execute(query, params).fetchall()
-    statuses = db.execute('SELECT DISTINCT status FROM routes').fetchall()
+    statuses = get_facets(db, 'routes', 'status')
     
     db.close()
     
@@ -461,17 +632,30 @@ def warehouse():
     
     query += ' ORDER BY storage_zone, cargo_name'
     
-    items = db.execute(query, params).fetchall()
+    cursor = db.execute(query, params)
+    
+    # Статистика по агрегатам зон (грузы, находящиеся на складе)
+    zones = db.execute('''
+        SELECT z.name AS storage_zone, z.capacity_volume, z.used_volume, z.item_count,
+               COALESCE(f.count, 0) AS count
+        FROM warehouse_zones z
+        LEFT JOIN facet_counts f
+            ON f.table_name = 'warehouse' AND f.column_name = 'storage_zone' AND f.value = z.name
+        ORDER BY z.name
+    ''').fetchall()
     
-    # Статистика
     stats = {
-        'total_items': db.execute('SELECT COUNT(*) as count FROM warehouse').fetchone()['count'],
-        'total_volume': db.execute('SELECT SUM(volume) as sum FROM warehouse').fetchone()['sum'] or 0,
+        'total_items': sum(z['item_count'] for z in zones),
+        'total_volume': sum(z['used_volume'] for z in zones),
     }
     
-    statuses = db.execute('SELECT DISTINCT status FROM warehouse').fetchall()
-    zones = db.execute('SELECT DISTINCT storage_zone FROM warehouse').fetchall()
+    statuses = get_facets(db, 'warehouse', 'status')
+    
+    if current_app.config.get('STREAM_LIST_PAGES'):
+        return stream_page('logistic/warehouse.html', db, items=RowStream(cursor), stats=stats, statuses=statuses,
+                           zones=zones, current_status=status_filter, current_zone=zone_filter)
     
+    items = cursor.fetchall()
     db.close()
     
     return render_template('logistic/warehouse.html', items=items, stats=stats, statuses=statuses, zones=zones, current_status=status_filter, current_zone=zone_filter)
@@ -527,7 +711,7 @@ def routes():
     
     driver_id = driver['id']
     
-    my_routes = db.execute('''
+    cursor = db.execute('''
         SELECT r.id, r.order_id, o.order_number, o.address_from, o.address_to, o.cargo_description,
                o.weight, r.status, r.planned_start_time, r.planned_end_time, v.brand, v.model
         FROM routes r
@@ -535,8 +719,12 @@ def routes():
         LEFT JOIN vehicles v ON r.vehicle_id = v.id
         WHERE r.driver_id = ?
         ORDER BY r.planned_start_time DESC
-    ''', (driver_id,)).fetchall()
+    ''', (driver_id,))
+    
+    if current_app.config.get('STREAM_LIST_PAGES'):
+        return stream_page('driver/routes.html', db, routes=RowStream(cursor))
     
+    my_routes = cursor.fetchall()
     db.close()
     
     return render_template('driver/routes.html', routes=my_routes)
@@ -562,20 +750,11 @@ def update_route_status(route_id):
     
     try:
         if new_status == 'В пути':
-            db.execute('UPDATE routes SET status = ?, actual_start_time = ? WHERE id = ?',
-                      (new_status, datetime.now(), route_id))
+            if not start_route(db, route_id):
+                return jsonify({'success': False, 'message': f"Маршрут в статусе '{route['status']}' не может быть начат"})
         elif new_status == 'Завершен':
-            db.execute('UPDATE routes SET status = ?, actual_end_time = ? WHERE id = ?',
-                      (new_status, datetime.now(), route_id))
-            
-            # Обновить статус заказа
-            order_id = route['order_id']
-            db.execute('UPDATE orders SET status = ?, actual_delivery_date = ? WHERE id = ?',
-                      ('Доставлен', datetime.now().date(), order_id))
-            
-            # Освободить транспорт и водителя
-            db.execute('UPDATE vehicles SET status = ? WHERE id = ?', ('Свободен', route['vehicle_id']))
-            db.execute('UPDATE drivers SET is_available = ? WHERE id = ?', (1, driver['id']))
+            if not complete_route(db, route):
+                return jsonify({'success': False, 'message': 'Маршрут уже завершен'})
         
         db.commit()
         return jsonify({'success': True, 'message': 'Статус обновлен'})
@@ -594,60 +773,515 @@ def notifications():
     
     user_id = session['user_id']
     
-    notifs = db.execute('''
+    cursor = db.execute('''
         SELECT id, message, type, is_read, created_at
         FROM notifications
         WHERE user_id = ?
         ORDER BY created_at DESC
-    ''', (user_id,)).fetchall()
+    ''', (user_id,))
+    
+    if current_app.config.get('STREAM_LIST_PAGES'):
+        return stream_page('driver/notifications.html', db, notifications=RowStream(cursor))
     
+    notifs = cursor.fetchall()
     db.close()
     
     return render_template('driver/notifications.html', notifications=notifs)
 
 # ============ API ============
+@api_bp.after_request
+def compress_response(response):
+    """Сжатие ответов API (gzip/deflate), если клиент их принимает"""
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+    if encoding:
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    
+    return response
+
 @api_bp.route('/available-vehicles')
 @login_required
 def get_available_vehicles():
-    """API: получить доступный транспорт"""
+    """API: получить доступный транспорт
+    
+    Каждое ТС дополняется прогнозом дней до ТО. ТС, которым ТО требуется в течение
+    due_days дней, ставятся в конец списка, а при exclude_due=1 исключаются.
+    """
     required_capacity = request.args.get('capacity', type=float, default=0)
+    due_days = request.args.get('due_days', type=float, default=DUE_SOON_DAYS)
+    exclude_due = request.args.get('exclude_due', type=int, default=0)
     
     db = get_db()
-    vehicles = db.execute('''
+    cursor = db.execute('''
         SELECT id, brand, model, license_plate, capacity
         FROM vehicles
         WHERE status = 'Свободен' AND capacity >= ?
         ORDER BY capacity
-    ''', (required_capacity,)).fetchall()
+    ''', (required_capacity,))
+    cursor.row_factory = None
+    vehicles = cursor.fetchall()
+    columns = [d[0] for d in cursor.description] + ['days_to_maintenance', 'maintenance_due']
+    forecast = get_forecast(db)
+    db.close()
+    
+    rows = []
+    for vehicle, days in zip(vehicles, days_to_maintenance(forecast, [v[0] for v in vehicles])):
+        due = days is not None and days <= due_days
+        if due and exclude_due:
+            continue
+        rows.append((*vehicle, days, due))
+    
+    rows.sort(key=lambda v: v[-1])
+    
+    return list_response(columns, rows)
+
+@api_bp.route('/maintenance-forecast')
+@role_required('Логист', 'Администратор')
+def get_maintenance_forecast():
+    """API: ТС, которым потребуется ТО в ближайшие days дней"""
+    days = request.args.get('days', type=float, default=30)
+    
+    db = get_db()
+    forecast = get_forecast(db, max_age=0)
+    due = np.flatnonzero(forecast['days'] <= days)
+    due = due[np.argsort(forecast['days'][due], kind='stable')]
+    
+    vehicles = {v['id']: v for v in db.execute(
+        'SELECT id, brand, model, license_plate, status, current_mileage, next_maintenance_km FROM vehicles'
+        ' WHERE id IN (SELECT value FROM json_each(?))',
+        (json.dumps(forecast['id'][due].tolist()),)
+    ).fetchall()}
     db.close()
     
-    return jsonify([dict(v) for v in vehicles])
+    columns = ['id', 'brand', 'model', 'license_plate', 'status', 'current_mileage', 'next_maintenance_km',
+               'remaining_km', 'daily_km', 'days_to_maintenance']
+    rows = []
+    for i in due:
+        vehicle = vehicles.get(int(forecast['id'][i]))
+        if vehicle:
+            rows.append((*vehicle, float(forecast['remaining_km'][i]), round(float(forecast['daily_km'][i]), 1),
+                         round(float(forecast['days'][i]), 1)))
+    
+    return list_response(columns, rows)
 
 @api_bp.route('/available-drivers')
 @login_required
 def get_available_drivers():
     """API: получить доступных водителей"""
     db = get_db()
-    drivers = db.execute('''
+    response = cursor_response(db.execute('''
         SELECT id, full_name, experience_years, license_number
         FROM drivers
         WHERE is_available = 1
-    ''').fetchall()
+    '''))
     db.close()
     
-    return jsonify([dict(d) for d in drivers])
+    return response
 
 @api_bp.route('/order-status-history/<int:order_id>')
 @login_required
 def get_order_status_history(order_id):
-    """API: история статусов заказа"""
+    """API: история статусов заказа (с архивом при archive=1)"""
     db = get_db()
-    history = db.execute('''
+    
+    source = 'order_status_history'
+    if request.args.get('archive', type=int, default=0) and attach_archive(db):
+        source = '''(SELECT order_id, old_status, new_status, changed_at, notes FROM main.order_status_history
+                   UNION ALL
+                   SELECT order_id, old_status, new_status, changed_at, notes FROM archive.order_status_history)'''
+    
+    response = cursor_response(db.execute(f'''
         SELECT old_status, new_status, changed_at, notes
-        FROM order_status_history
+        FROM {source}
         WHERE order_id = ?
         ORDER BY changed_at DESC
-    ''', (order_id,)).fetchall()
+    ''', (order_id,)))
+    db.close()
+    
+    return response
+
+@api_bp.route('/warehouse/zones')
+@login_required
+def get_warehouse_zones():
+    """API: заполненность складских зон"""
+    db = get_db()
+    response = cursor_response(db.execute('''
+        SELECT name, capacity_volume, used_volume, item_count,
+               capacity_volume - used_volume AS free_volume
+        FROM warehouse_zones
+        ORDER BY name
+    '''))
     db.close()
     
-    return jsonify([dict(h) for h in history])
+    return response
+
+@api_bp.route('/warehouse/zones/<name>', methods=['PUT'])
+@role_required('Логист', 'Администратор')
+def set_warehouse_zone(name):
+    """API: создание складской зоны или изменение ее лимита объема
+    
+    Тело запроса: {"capacity_volume": 250.0}; null снимает лимит (зона не участвует
+    в автоматическом размещении).
+    """
+    payload = request.get_json(silent=True) or {}
+    capacity = payload.get('capacity_volume')
+    
+    if 'capacity_volume' not in payload or (capacity is not None and (
+            isinstance(capacity, bool) or not isinstance(capacity, (int, float)) or capacity < 0)):
+        return jsonify({'success': False, 'message': 'Некорректный лимит объема зоны'}), 400
+    
+    db = get_db()
+    try:
+        db.execute('''
+            INSERT INTO warehouse_zones (name, capacity_volume) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET capacity_volume = excluded.capacity_volume
+        ''', (name, capacity))
+        db.commit()
+        
+        zone = db.execute('''
+            SELECT name, capacity_volume, used_volume, item_count,
+                   capacity_volume - used_volume AS free_volume
+            FROM warehouse_zones WHERE name = ?
+        ''', (name,)).fetchone()
+        return jsonify({'success': True, 'zone': dict(zone)})
+    finally:
+        db.close()
+
+@api_bp.route('/warehouse/putaway', methods=['POST'])
+@role_required('Логист', 'Администратор')
+def warehouse_putaway():
+    """API: размещение партии или всей входящей поставки по зонам склада
+    
+    Тело запроса: одна партия {"cargo_name", "quantity", "volume", "order_id"} или
+    {"items": [...], "dry_run": false}. При dry_run зоны только подбираются. Зоны без
+    лимита объема не участвуют в размещении и перечисляются в zones_without_capacity.
+    """
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('items') if 'items' in payload else [payload]
+    dry_run = bool(payload.get('dry_run'))
+    
+    if not isinstance(items, list) or not items or not all(isinstance(i, dict) for i in items):
+        return jsonify({'success': False, 'message': 'Не указаны партии'}), 400
+    
+    db = get_db()
+    try:
+        results = putaway(db, items, dry_run)
+        unlimited = zones_without_capacity(db)
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+        
+        placed = sum(1 for r in results if r['storage_zone'])
+        response = {'success': placed == len(results), 'placed': placed, 'results': results,
+                    'zones_without_capacity': unlimited}
+        if placed < len(results) and unlimited:
+            response['message'] = 'Не задан лимит объема зон: ' + ', '.join(unlimited)
+        return jsonify(response)
+    
+    except ValueError as e:
+        db.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        db.close()
+
+@api_bp.route('/warehouse/<int:item_id>/depart', methods=['POST'])
+@role_required('Логист', 'Администратор')
+def warehouse_depart(item_id):
+    """API: отгрузка груза со склада"""
+    db = get_db()
+    try:
+        cursor = db.execute('''
+            UPDATE warehouse SET status = ?, departure_date = ?
+            WHERE id = ? AND departure_date IS NULL
+        ''', ('Отгружен', datetime.now(), item_id))
+        db.commit()
+        
+        if cursor.rowcount == 0:
+            return jsonify({'success': False, 'message': 'Груз не найден или уже отгружен'})
+        return jsonify({'success': True, 'message': 'Груз отгружен'})
+    finally:
+        db.close()
+
+@api_bp.route('/consolidation', methods=['POST'])
+@role_required('Логист', 'Администратор')
+def consolidate_orders():
+    """API: консолидация ожидающих заказов в многоточечные рейсы
+    
+    Тело запроса: {"dry_run": false, "exclude_due": true}. При exclude_due не
+    используются ТС, которым ТО требуется в ближайшие дни.
+    """
+    payload = request.get_json(silent=True) or {}
+    dry_run = bool(payload.get('dry_run'))
+    
+    db = get_db()
+    try:
+        excluded = []
+        if payload.get('exclude_due', True):
+            forecast = get_forecast(db)
+            excluded = forecast['id'][forecast['days'] <= DUE_SOON_DAYS].tolist()
+        
+        db.execute('BEGIN IMMEDIATE')
+        plan = consolidate(db, session['user_id'], excluded, dry_run)
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+        
+        return jsonify({'success': True, **plan})
+    
+    except Exception as e:
+        db.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        db.close()
+
+@api_bp.route('/quote')
+@role_required('Логист', 'Администратор')
+def get_quote():
+    """API: расчет стоимости заказа по тарифам (параметры client_id, weight, address_from,
+    address_to, planned_delivery_date)
+    
+    Без weight стоимость рассчитывается для нулевого веса (самый легкий весовой диапазон).
+    """
+    db = get_db()
+    try:
+        quote = quote_order(db, {field: request.args.get(field) for field in
+                                 ('client_id', 'weight', 'address_from', 'address_to', 'planned_delivery_date')})
+        if not quote:
+            return jsonify({'success': False, 'message': 'Нет тарифа для указанного веса или маршрута'}), 404
+        return jsonify({'success': True, **quote})
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        db.close()
+
+@api_bp.route('/quotes', methods=['POST'])
+@role_required('Логист', 'Администратор')
+def get_quotes():
+    """API: пакетный расчет стоимости заказов-кандидатов
+    
+    Тело запроса: {"orders": [{"client_id": 1, "weight": 3.5, "address_from": "...",
+    "address_to": "...", "planned_delivery_date": "2026-02-01"}, ...]}. Ответ - строки
+    в порядке заказов; cost равна null, если тариф не найден. Заказ без weight
+    рассчитывается для нулевого веса (самый легкий весовой диапазон).
+    """
+    orders = (request.get_json(silent=True) or {}).get('orders')
+    fields = ('client_id', 'weight', 'address_from', 'address_to', 'planned_delivery_date')
+    if not isinstance(orders, list) or not orders:
+        return jsonify({'success': False, 'message': 'Список заказов пуст'}), 400
+    if not all(isinstance(o, dict) for o in orders):
+        return jsonify({'success': False, 'message': 'Некорректный список заказов'}), 400
+    if len(orders) > QUOTE_BATCH_LIMIT:
+        return jsonify({'success': False, 'message': f'Не более {QUOTE_BATCH_LIMIT} заказов в запросе'}), 400
+    
+    db = get_db()
+    try:
+        quotes = quote_orders(db, [{field: o.get(field) for field in fields} for o in orders])
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        db.close()
+    
+    columns = ['cost', 'distance_km', 'urgency_multiplier', 'discount_percent']
+    values = (quotes['cost'], quotes['distance_km'], quotes['urgency_multiplier'], quotes['discount'] * 100)
+    rows = [tuple(None if np.isnan(v) else round(float(v), 2) for v in row) for row in zip(*values)]
+    return list_response(columns, rows)
+
+@api_bp.route('/driver/changes')
+@role_required('Водитель')
+def get_driver_changes():
+    """API: изменения маршрутов, заказов и уведомлений водителя после курсора
+    
+    Без параметра cursor возвращается полный набор данных. Ответ содержит измененные
+    строки, удаленные id (deleted), новый курсор и признак has_more. Колоночный формат
+    не поддерживается: ответ - составной объект, а не список строк.
+    """
+    db = get_db()
+    try:
+        driver = db.execute('SELECT id FROM drivers WHERE user_id = ?', (session['user_id'],)).fetchone()
+        if not driver:
+            return jsonify({'success': False, 'message': 'Профиль водителя не найден'}), 404
+        
+        changes = changes_since(db, driver['id'], session['user_id'], request.args.get('cursor'))
+        return jsonify({'success': True, **changes})
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        db.close()
+
+# Статусы заказа, которые можно установить пакетной операцией
+ORDER_STATUSES = ('Создан', 'Назначен', 'В пути', 'Доставлен')
+
+def batch_set_status(db, operation, user_id):
+    """Пакетная операция: смена статуса заказа"""
+    status = operation.get('status')
+    if not status:
+        raise ValueError('Не указан статус')
+    if status not in ORDER_STATUSES:
+        raise ValueError(f'Неизвестный статус заказа: {status}')
+    
+    order = db.execute('SELECT id, status FROM orders WHERE id = ?', (operation.get('order_id'),)).fetchone()
+    if not order:
+        raise ValueError('Заказ не найден')
+    
+    if order['status'] != status:
+        db.execute('UPDATE orders SET status = ? WHERE id = ?', (status, order['id']))
+        record_status_change(db, order['id'], order['status'], status, user_id)
+    
+    return {'order_id': order['id'], 'status': status}
+
+def batch_set_delivery_date(db, operation, user_id):
+    """Пакетная операция: изменение планового срока доставки заказа"""
+    planned_delivery_date = parse_delivery_date(operation.get('planned_delivery_date'))
+    
+    cursor = db.execute('UPDATE orders SET planned_delivery_date = ? WHERE id = ?',
+                        (planned_delivery_date, operation.get('order_id')))
+    if cursor.rowcount == 0:
+        raise ValueError('Заказ не найден')
+    
+    # Новый срок передается монитору сроков после фиксации пакета
+    return {'order_id': operation.get('order_id'), 'planned_delivery_date': planned_delivery_date}
+
+def batch_set_cost(db, operation, user_id):
+    """Пакетная операция: изменение стоимости заказа"""
+    cost = operation.get('cost')
+    if isinstance(cost, bool) or not isinstance(cost, (int, float)) or cost < 0:
+        raise ValueError('Некорректная стоимость')
+    
+    cursor = db.execute('UPDATE orders SET cost = ? WHERE id = ?', (cost, operation.get('order_id')))
+    if cursor.rowcount == 0:
+        raise ValueError('Заказ не найден')
+    
+    return {'order_id': operation.get('order_id'), 'cost': cost}
+
+def batch_assign(db, operation, user_id):
+    """Пакетная операция: назначение транспорта и водителя на заказ"""
+    order = db.execute('SELECT id, status, address_from, address_to FROM orders WHERE id = ?',
+                       (operation.get('order_id'),)).fetchone()
+    if not order:
+        raise ValueError('Заказ не найден')
+    
+    # Назначаются только ожидающие заказы без незавершенного маршрута
+    if order['status'] != 'Создан':
+        raise ValueError(f"Заказ в статусе '{order['status']}' не может быть назначен")
+    if db.execute("SELECT 1 FROM routes WHERE order_id = ? AND status != 'Завершен'", (order['id'],)).fetchone():
+        raise ValueError('У заказа уже есть незавершенный маршрут')
+    
+    vehicle = db.execute("SELECT id FROM vehicles WHERE id = ? AND status = 'Свободен'",
+                         (operation.get('vehicle_id'),)).fetchone()
+    if not vehicle:
+        raise ValueError('Транспорт не найден или занят')
+    
+    driver = db.execute('SELECT id FROM drivers WHERE id = ? AND is_available = 1',
+                        (operation.get('driver_id'),)).fetchone()
+    if not driver:
+        raise ValueError('Водитель не найден или занят')
+    
+    route_id = assign_route(db, order['id'], driver['id'], vehicle['id'], order['address_from'], order['address_to'])
+    if order['status'] != 'Назначен':
+        record_status_change(db, order['id'], order['status'], 'Назначен', user_id, 'Назначен транспорт')
+    
+    return {'order_id': order['id'], 'route_id': route_id}
+
+def batch_start_route(db, operation, user_id):
+    """Пакетная операция: начало движения по маршруту"""
+    route = db.execute('SELECT id, status FROM routes WHERE id = ?', (operation.get('route_id'),)).fetchone()
+    if not route:
+        raise ValueError('Маршрут не найден')
+    
+    if not start_route(db, route['id']):
+        raise ValueError(f"Маршрут в статусе '{route['status']}' не может быть начат")
+    return {'route_id': route['id'], 'status': 'В пути'}
+
+def batch_complete_route(db, operation, user_id):
+    """Пакетная операция: завершение маршрута"""
+    route = db.execute('SELECT * FROM routes WHERE id = ?', (operation.get('route_id'),)).fetchone()
+    if not route:
+        raise ValueError('Маршрут не найден')
+    
+    if not complete_route(db, route):
+        raise ValueError('Маршрут уже завершен')
+    return {'route_id': route['id'], 'status': 'Завершен'}
+
+BATCH_OPERATIONS = {
+    'set_status': batch_set_status,
+    'set_cost': batch_set_cost,
+    'set_delivery_date': batch_set_delivery_date,
+    'assign': batch_assign,
+    'start_route': batch_start_route,
+    'complete_route': batch_complete_route,
+}
+
+@api_bp.route('/batch', methods=['POST'])
+@role_required('Логист', 'Администратор')
+def batch():
+    """API: пакетное выполнение операций над заказами и маршрутами в одной транзакции
+    
+    Тело запроса: {"operations": [{"op": "set_status", "order_id": 1, "status": "В пути"}, ...],
+    "atomic": false}. Каждая операция выполняется в своей точке сохранения: ошибка
+    откатывает только её. При "atomic": true ошибка любой операции откатывает весь пакет.
+    """
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations')
+    atomic = bool(payload.get('atomic'))
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'message': 'Список операций пуст'}), 400
+    
+    user_id = session['user_id']
+    results = []
+    
+    db = get_db()
+    try:
+        db.execute('BEGIN')
+        
+        for index, operation in enumerate(operations):
+            handler = BATCH_OPERATIONS.get(operation.get('op')) if isinstance(operation, dict) else None
+            if not handler:
+                results.append({'index': index, 'success': False, 'message': 'Неизвестная операция'})
+                if atomic:
+                    break
+                continue
+            
+            db.execute('SAVEPOINT batch_operation')
+            try:
+                result = handler(db, operation, user_id)
+                db.execute('RELEASE SAVEPOINT batch_operation')
+                results.append({'index': index, 'success': True, **result})
+            except (ValueError, sqlite3.Error) as e:
+                db.execute('ROLLBACK TO SAVEPOINT batch_operation')
+                db.execute('RELEASE SAVEPOINT batch_operation')
+                results.append({'index': index, 'success': False, 'message': str(e)})
+                if atomic:
+                    break
+        
+        failed = [r for r in results if not r['success']]
+        if atomic and failed:
+            db.rollback()
+            return jsonify({'success': False, 'message': 'Пакет отменен', 'results': results}), 409
+        
+        db.commit()
+        
+        # Монитор сроков получает только зафиксированные изменения
+        for result in results:
+            if result['success'] and 'planned_delivery_date' in result:
+                watch_deadline('orders', result['order_id'], result['planned_delivery_date'])
+        
+        return jsonify({'success': not failed, 'applied': len(results) - len(failed), 'results': results})
+    
+    except Exception as e:
+        db.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        db.close()
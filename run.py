@@ -1,13 +1,16 @@
 """Точка входа приложения Логист-Транс"""
 import os
 import sys
-from init_db import init_database
+from init_db import init_database, upgrade_database
 
 # Инициализация БД если её нет
 if not os.path.exists('logist_trans.db'):
     print("Инициализация базы данных...")
     init_database()
 
+# Обновление схемы существующей БД
+upgrade_database()
+
 from app import create_app
 
 app = create_app()
@@ -0,0 +1,271 @@
+"""Контроль сроков доставки (SLA): таймеры по planned_delivery_date и planned_end_time"""
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+# В память загружаются сроки, наступающие в ближайшие SLA_HORIZON (с округлением до суток)
+SLA_HORIZON = timedelta(hours=24)
+# Интервал перечитывания сроков из БД (изменения из других процессов), секунд
+SLA_RELOAD_INTERVAL = 600.0
+
+# Запросы используют частичные индексы idx_orders_sla и idx_routes_sla: условия
+# по статусу должны совпадать с условиями индексов
+DEADLINE_QUERIES = {
+    'orders': '''
+        SELECT id, planned_delivery_date FROM orders
+        WHERE status != 'Доставлен' AND planned_delivery_date < ?
+          AND NOT EXISTS (SELECT 1 FROM sla_alerts a WHERE a.entity = 'orders' AND a.entity_id = orders.id
+                          AND a.deadline = orders.planned_delivery_date)
+    ''',
+    'routes': '''
+        SELECT id, planned_end_time FROM routes
+        WHERE status != 'Завершен' AND planned_end_time < ?
+          AND NOT EXISTS (SELECT 1 FROM sla_alerts a WHERE a.entity = 'routes' AND a.entity_id = routes.id
+                          AND a.deadline = routes.planned_end_time)
+    ''',
+}
+
+# Просроченные объекты: срок, номер заказа и ответственный логист (автор заказа
+# или, если он не указан, первый активный логист)
+OVERDUE_QUERIES = {
+    'orders': '''
+        SELECT o.id, o.planned_delivery_date AS deadline, o.id AS order_id, o.order_number,
+               COALESCE(o.created_by_id, (SELECT id FROM users WHERE role = 'Логист' AND is_active = 1
+                                          ORDER BY id LIMIT 1)) AS user_id
+        FROM orders o
+        WHERE o.status != 'Доставлен' AND o.id IN (SELECT value FROM json_each(?))
+    ''',
+    'routes': '''
+        SELECT r.id, r.planned_end_time AS deadline, r.order_id, o.order_number,
+               COALESCE(o.created_by_id, (SELECT id FROM users WHERE role = 'Логист' AND is_active = 1
+                                          ORDER BY id LIMIT 1)) AS user_id
+        FROM routes r
+        JOIN orders o ON r.order_id = o.id
+        WHERE r.status != 'Завершен' AND r.id IN (SELECT value FROM json_each(?))
+    ''',
+}
+
+ALERT_MESSAGES = {
+    'orders': 'Заказ {order_number} не доставлен в срок ({deadline})',
+    'routes': 'Маршрут №{id} по заказу {order_number} не завершен в срок ({deadline})',
+}
+
+def deadline_timestamp(value):
+    """Срок в секундах Unix: дата без времени означает конец дня, None - срок не задан"""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if len(str(value)) <= 10:
+        moment += timedelta(days=1)
+    return moment.timestamp()
+
+class SlaMonitor:
+    """Таймеры сроков заказов и маршрутов в куче (heapq) с потоком-обработчиком
+
+    В памяти хранятся только сроки ближайшего окна; они загружаются по частичным
+    индексам при запуске и каждые SLA_RELOAD_INTERVAL секунд, а изменения из
+    приложения передаются через watch(). При срабатывании таймера состояние
+    проверяется по БД, а уведомление создается один раз благодаря таблице sla_alerts.
+    """
+
+    def __init__(self, db_path, horizon=SLA_HORIZON, reload_interval=SLA_RELOAD_INTERVAL):
+        self.db_path = db_path
+        self.horizon = horizon
+        self.reload_interval = reload_interval
+        self._heap = []  # (срок, сущность, id); устаревшие элементы пропускаются
+        self._deadlines = {}  # (сущность, id) -> действующий срок
+        self._loaded_until = 0.0
+        self._next_reload = 0.0
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.stats = {'loaded': 0, 'fired': 0, 'alerts': 0}
+
+    def start(self):
+        """Запуск потока-обработчика таймеров"""
+        self._thread = threading.Thread(target=self._run, name='sla-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Остановка потока-обработчика"""
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _push(self, entity, entity_id, moment):
+        """Установка таймера (вызывается под self._condition)"""
+        key = (entity, entity_id)
+        if moment is None or moment >= self._loaded_until:
+            # Срок вне окна будет загружен при следующем перечитывании
+            self._deadlines.pop(key, None)
+            return False
+        if self._deadlines.get(key) == moment:
+            return False
+        self._deadlines[key] = moment
+        heapq.heappush(self._heap, (moment, entity, entity_id))
+        return True
+
+    def watch(self, entity, entity_id, deadline):
+        """Учет нового или измененного срока ('orders' или 'routes', значение из БД)"""
+        moment = deadline_timestamp(deadline)
+        with self._condition:
+            if self._push(entity, entity_id, moment) and self._heap[0][0] == moment:
+                self._condition.notify()
+
+    def load(self, db):
+        """Загрузка сроков окна из БД; возвращает количество установленных таймеров"""
+        cutoff = (datetime.now() + self.horizon).date() + timedelta(days=1)
+        rows = {entity: db.execute(query, (cutoff.isoformat(),)).fetchall()
+                for entity, query in DEADLINE_QUERIES.items()}
+
+        loaded = 0
+        with self._condition:
+            self._loaded_until = datetime.combine(cutoff, datetime.min.time()).timestamp()
+            for entity, entity_rows in rows.items():
+                for entity_id, deadline in entity_rows:
+                    loaded += self._push(entity, entity_id, deadline_timestamp(deadline))
+            self._next_reload = time.time() + self.reload_interval
+            self.stats['loaded'] += loaded
+            self._condition.notify()
+        return loaded
+
+    def pop_due(self, now):
+        """Извлечение наступивших сроков: список (сущность, id)"""
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                moment, entity, entity_id = heapq.heappop(self._heap)
+                if self._deadlines.get((entity, entity_id)) == moment:
+                    del self._deadlines[(entity, entity_id)]
+                    due.append((entity, entity_id))
+        return due
+
+    def process(self, db, due):
+        """Проверка наступивших сроков по БД и создание уведомлений; возвращает их количество
+
+        Доставленные заказы и завершенные маршруты пропускаются, перенесенный на
+        будущее срок снова ставится на таймер.
+        """
+        by_entity = {}
+        for entity, entity_id in due:
+            by_entity.setdefault(entity, []).append(entity_id)
+
+        now = time.time()
+        alerts = 0
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for entity, ids in by_entity.items():
+                for row in db.execute(OVERDUE_QUERIES[entity], (json.dumps(ids),)).fetchall():
+                    moment = deadline_timestamp(row['deadline'])
+                    if moment is None:
+                        continue
+                    if moment > now:
+                        self.watch(entity, row['id'], row['deadline'])
+                        continue
+
+                    cursor = db.execute('INSERT OR IGNORE INTO sla_alerts (entity, entity_id, deadline) VALUES (?, ?, ?)',
+                                        (entity, row['id'], row['deadline']))
+                    if cursor.rowcount and row['user_id']:
+                        db.execute('INSERT INTO notifications (user_id, message, type, order_id) VALUES (?, ?, ?, ?)',
+                                   (row['user_id'], ALERT_MESSAGES[entity].format(**{**dict(row), 'deadline': str(row['deadline'])[:16]}),
+                                    'Нарушение срока', row['order_id']))
+                        alerts += 1
+            db.commit()
+        except sqlite3.Error:
+            # Сроки без записи в sla_alerts будут загружены при следующем перечитывании
+            db.rollback()
+            raise
+
+        self.stats['fired'] += len(due)
+        self.stats['alerts'] += alerts
+        return alerts
+
+    def _run(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if time.time() >= self._next_reload:
+                        self.load(db)
+                    due = self.pop_due(time.time())
+                    if due:
+                        self.process(db, due)
+                except sqlite3.Error:
+                    self._next_reload = time.time() + 5
+
+                with self._condition:
+                    wake_at = min(self._heap[0][0] if self._heap else self._next_reload, self._next_reload)
+                    if not self._stopping.is_set():
+                        self._condition.wait(max(wake_at - time.time(), 0.01))
+        finally:
+            db.close()
+
+def init_app(app, db_path='logist_trans.db'):
+    """Запуск монитора сроков для приложения (SLA_MONITOR = False отключает его)"""
+    if app.config.get('SLA_MONITOR', True):
+        monitor = SlaMonitor(db_path)
+        monitor.start()
+        app.extensions['sla_monitor'] = monitor
+
+if __name__ == '__main__':
+    # Бенчмарк на 1M открытых заказов: python -m app.sla
+    import os
+    import random
+    import tempfile
+
+    from app.init_db import init_database
+
+    orders_count = 1_000_000
+    random.seed(0)
+
+    path = os.path.join(tempfile.mkdtemp(), 'sla_bench.db')
+    init_database(path)
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+
+    today = datetime.now().date()
+    started = time.perf_counter()
+    db.executemany('INSERT INTO orders (order_number, client_id, address_from, address_to, planned_delivery_date, '
+                   "status, created_by_id) VALUES (?, 1, 'Москва', 'Казань', ?, 'Создан', 2)",
+                   ((f'BENCH-{i}', (today + timedelta(days=random.randint(-2, 365))).isoformat())
+                    for i in range(orders_count)))
+    db.commit()
+    print(f'Создано открытых заказов: {orders_count}, {time.perf_counter() - started:.1f} с')
+
+    started = time.perf_counter()
+    overdue = db.execute("SELECT COUNT(*) FROM orders NOT INDEXED WHERE status != 'Доставлен' "
+                         'AND planned_delivery_date < ?', (today.isoformat(),)).fetchone()[0]
+    print(f'Опрос всей таблицы (без индекса): {(time.perf_counter() - started) * 1000:.0f} мс, просрочено: {overdue}')
+
+    monitor = SlaMonitor(path)
+    started = time.perf_counter()
+    loaded = monitor.load(db)
+    print(f'Загрузка окна {SLA_HORIZON.total_seconds() / 3600:.0f} ч по индексу: {(time.perf_counter() - started) * 1000:.0f} мс, таймеров: {loaded}')
+
+    started = time.perf_counter()
+    due = monitor.pop_due(time.time())
+    alerts = monitor.process(db, due)
+    print(f'Обработка просроченных: {len(due)} таймеров, {alerts} уведомлений, '
+          f'{(time.perf_counter() - started) * 1000:.0f} мс')
+
+    started = time.perf_counter()
+    loaded = monitor.load(db)
+    print(f'Перечитывание окна: {(time.perf_counter() - started) * 1000:.0f} мс, новых таймеров: {loaded}')
+
+    ids = random.sample(range(1, orders_count), 100_000)
+    started = time.perf_counter()
+    for order_id in ids:
+        monitor.watch('orders', order_id, (today + timedelta(days=random.randint(0, 1))).isoformat())
+    elapsed = time.perf_counter() - started
+    print(f'Инкрементальные изменения: {len(ids) / elapsed:,.0f} watch()/с, таймеров в куче: {len(monitor._heap)}')
+    db.close()
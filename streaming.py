@@ -0,0 +1,129 @@
+"""Потоковая отрисовка страниц со списками: шаблон выводится частями по мере чтения строк из БД"""
+from flask import Response, stream_template
+
+# Количество строк, читаемых из курсора за один fetchmany
+STREAM_BATCH_SIZE = 500
+# Минимальный размер отправляемой части страницы, байт
+STREAM_CHUNK_SIZE = 16 * 1024
+
+class RowStream:
+    """Строки курсора для шаблона, читаемые порциями fetchmany
+
+    Поддерживает однократный проход циклом for и проверку на пустоту
+    ({% if rows %}), для которой читается только первая порция. Фильтр length
+    и loop.length недоступны без чтения всех строк.
+    """
+
+    def __init__(self, cursor, batch_size=STREAM_BATCH_SIZE):
+        self._cursor = cursor
+        self._batch_size = batch_size
+        self._pending = []
+
+    def __bool__(self):
+        if not self._pending:
+            self._pending = self._cursor.fetchmany(self._batch_size)
+        return bool(self._pending)
+
+    def __iter__(self):
+        while True:
+            rows = self._pending or self._cursor.fetchmany(self._batch_size)
+            self._pending = []
+            if not rows:
+                return
+            yield from rows
+
+def buffered(fragments, chunk_size=STREAM_CHUNK_SIZE):
+    """Объединение мелких фрагментов шаблона в части не меньше chunk_size байт"""
+    parts, size = [], 0
+    for fragment in fragments:
+        data = fragment.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b''.join(parts)
+
+def stream_page(template_name, db, chunk_size=STREAM_CHUNK_SIZE, **context):
+    """Потоковый ответ со страницей шаблона, строки которой читаются из RowStream
+
+    Заголовок страницы отправляется вместе с первой порцией строк, не дожидаясь
+    остальных. Соединение db закрывается после отправки страницы или при обрыве
+    соединения клиентом. Курсор строк остается открытым, пока страница
+    отправляется клиенту: запись в БД при этом не блокируется благодаря журналу
+    WAL (включается в create_extended_schema).
+    """
+    fragments = stream_template(template_name, **context)
+
+    def generate():
+        try:
+            yield from buffered(fragments, chunk_size)
+        finally:
+            fragments.close()
+            db.close()
+
+    response = Response(generate(), mimetype='text/html')
+    # Отключение буферизации ответа обратным прокси (nginx)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+if __name__ == '__main__':
+    # Пиковая память при полной и потоковой отрисовке: python -m app.streaming
+    import sqlite3
+    import time
+    import tracemalloc
+    from types import SimpleNamespace
+
+    from flask import Flask, render_template
+    from jinja2 import DictLoader
+
+    app = Flask(__name__)
+    app.jinja_loader = DictLoader({'vehicles.html': '''<!doctype html>
+<html><head><title>Транспорт</title></head><body>
+<table>
+{% if vehicles %}{% for v in vehicles %}<tr><td>{{ v.id }}</td><td>{{ v.brand }} {{ v.model }}</td>
+<td>{{ v.license_plate }}</td><td>{{ v.capacity }}</td><td>{{ v.status }}</td></tr>
+{% endfor %}{% else %}<tr><td>Нет транспорта</td></tr>{% endif %}
+</table></body></html>'''})
+
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute('CREATE TABLE vehicles (id INTEGER PRIMARY KEY, brand TEXT, model TEXT, license_plate TEXT, '
+               'capacity REAL, status TEXT)')
+    query = 'SELECT * FROM vehicles ORDER BY id'
+
+    def measure(render):
+        tracemalloc.start()
+        started = time.perf_counter()
+        first_chunk = None
+        size = 0
+        with app.test_request_context():
+            for chunk in render():
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                size += len(chunk)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak, first_chunk, elapsed, size
+
+    def render_full():
+        yield render_template('vehicles.html', vehicles=db.execute(query).fetchall()).encode('utf-8')
+
+    def render_stream():
+        # Соединение бенчмарка общее для всех замеров и не закрывается
+        shared = SimpleNamespace(close=lambda: None)
+        return stream_page('vehicles.html', shared, vehicles=RowStream(db.execute(query))).response
+
+    total = 0
+    for rows in (10_000, 50_000, 100_000):
+        db.executemany("INSERT INTO vehicles (brand, model, license_plate, capacity, status) "
+                       "VALUES ('Volvo', 'FH16', ?, 20.5, 'Свободен')",
+                       ((f'А{i:07d}77',) for i in range(total, rows)))
+        total = rows
+        print(f'Строк: {rows} (время измерено под tracemalloc)')
+        for name, render in (('полная', render_full), ('потоковая', render_stream)):
+            peak, first_chunk, elapsed, size = measure(render)
+            print(f'  {name:10} пик памяти {peak / 1024 / 1024:7.1f} МБ, первая часть через '
+                  f'{first_chunk * 1000:6.1f} мс, всего {elapsed * 1000:6.0f} мс, {size / 1024 / 1024:.1f} МБ HTML')
@@ -0,0 +1,115 @@
+"""Дельта-синхронизация маршрутов, заказов и уведомлений для устройств водителей"""
+import base64
+import json
+
+# Максимальное число записей журнала в одном ответе
+SYNC_PAGE_SIZE = 500
+# Срок хранения журнала изменений, дней; более старые курсоры получают полный снимок
+SYNC_RETENTION_DAYS = 30
+
+ROUTE_QUERY = '''
+    SELECT r.id, r.order_id, o.order_number, o.address_from, o.address_to, o.cargo_description,
+           o.weight, r.status, r.planned_start_time, r.planned_end_time, v.brand, v.model,
+           r.trip_id, r.stop_sequence, r.updated_at
+    FROM routes r
+    JOIN orders o ON r.order_id = o.id
+    LEFT JOIN vehicles v ON r.vehicle_id = v.id
+'''
+
+ORDER_QUERY = '''
+    SELECT id, order_number, status, address_from, address_to, cargo_description, weight,
+           planned_delivery_date, actual_delivery_date, updated_at
+    FROM orders
+'''
+
+NOTIFICATION_QUERY = '''
+    SELECT id, message, type, is_read, order_id, created_at, updated_at
+    FROM notifications
+'''
+
+def encode_cursor(seq):
+    """Непрозрачный курсор синхронизации"""
+    return base64.urlsafe_b64encode(f'v1:{seq}'.encode()).decode()
+
+def decode_cursor(cursor):
+    """Номер записи журнала из курсора (ValueError для некорректного курсора)"""
+    try:
+        version, seq = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        if version != 'v1':
+            raise ValueError
+        return int(seq)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Некорректный курсор синхронизации')
+
+def fetch_by_ids(db, query, ids, id_column='id', condition=None, params=()):
+    """Строки запроса по списку id (одним запросом) с необязательным условием"""
+    if not ids:
+        return []
+    where = f'{id_column} IN (SELECT value FROM json_each(?))'
+    if condition:
+        where = f'{condition} AND {where}'
+    rows = db.execute(f'{query} WHERE {where}', (*params, json.dumps(sorted(ids))))
+    return [dict(row) for row in rows]
+
+def snapshot(db, driver_id, user_id):
+    """Полный набор данных водителя"""
+    routes = [dict(r) for r in db.execute(f'{ROUTE_QUERY} WHERE r.driver_id = ? ORDER BY r.id', (driver_id,))]
+    orders = fetch_by_ids(db, ORDER_QUERY, {r['order_id'] for r in routes})
+    notifications = [dict(n) for n in db.execute(f'{NOTIFICATION_QUERY} WHERE user_id = ? ORDER BY id', (user_id,))]
+    return {'routes': routes, 'orders': orders, 'notifications': notifications,
+            'deleted': {'routes': [], 'orders': [], 'notifications': []}}
+
+def changes_since(db, driver_id, user_id, cursor=None, page_size=SYNC_PAGE_SIZE):
+    """Изменения для водителя после курсора: измененные строки, удаления и новый курсор
+
+    Без курсора (или с курсором старше хранимого журнала) возвращается полный снимок
+    с reset = True. Чтение выполняется в одной транзакции, поэтому курсор согласован
+    с данными ответа.
+    """
+    since = decode_cursor(cursor) if cursor else None
+
+    db.execute('BEGIN')
+    try:
+        oldest, latest = db.execute('SELECT MIN(seq), MAX(seq) FROM sync_log').fetchone()
+        if since is None or (oldest is not None and since < oldest - 1):
+            return {**snapshot(db, driver_id, user_id), 'reset': True, 'has_more': False,
+                    'cursor': encode_cursor(latest or 0)}
+
+        log = db.execute('''
+            SELECT seq, entity, entity_id, op FROM sync_log
+            WHERE driver_id = ? AND seq > ?
+            ORDER BY seq LIMIT ?
+        ''', (driver_id, since, page_size + 1)).fetchall()
+        has_more = len(log) > page_size
+        log = log[:page_size]
+
+        # Для каждой сущности значима только последняя операция
+        last_op = {}
+        for entry in log:
+            last_op[(entry['entity'], entry['entity_id'])] = entry['op']
+        upserts = {'routes': set(), 'orders': set(), 'notifications': set()}
+        deleted = {'routes': set(), 'orders': set(), 'notifications': set()}
+        for (entity, entity_id), op in last_op.items():
+            (upserts if op == 'upsert' else deleted)[entity].add(entity_id)
+
+        result = {
+            'routes': fetch_by_ids(db, ROUTE_QUERY, upserts['routes'], 'r.id', 'r.driver_id = ?', (driver_id,)),
+            'orders': fetch_by_ids(db, ORDER_QUERY, upserts['orders']),
+            'notifications': fetch_by_ids(db, NOTIFICATION_QUERY, upserts['notifications'],
+                                          condition='user_id = ?', params=(user_id,)),
+        }
+
+        # Строки, удаленные после записи в журнал, передаются как удаления
+        for entity, rows in result.items():
+            deleted[entity] |= upserts[entity] - {row['id'] for row in rows}
+
+        new_seq = log[-1]['seq'] if has_more else max(since, latest or 0)
+
+        return {**result, 'deleted': {entity: sorted(ids) for entity, ids in deleted.items()},
+                'reset': False, 'has_more': has_more, 'cursor': encode_cursor(new_seq)}
+    finally:
+        db.rollback()
+
+def prune_sync_log(db, days=SYNC_RETENTION_DAYS):
+    """Удаление записей журнала старше days дней"""
+    db.execute("DELETE FROM sync_log WHERE changed_at < datetime('now', ?)", (f'-{days} days',))
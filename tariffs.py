@@ -0,0 +1,178 @@
+"""Расчет стоимости перевозки по тарифам: весовые диапазоны, расстояние, срочность, скидки клиентов"""
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from app.geo import distance_km
+
+# Максимальное число заказов в одном пакетном запросе расчета
+QUOTE_BATCH_LIMIT = 10_000
+
+_cache = {'tariffs': None, 'version': None}
+_cache_lock = threading.Lock()
+
+def load_tariffs(db):
+    """Тарифы в виде массивов для векторного поиска
+
+    Весовые диапазоны и пороги срочности упорядочены по верхней границе; за
+    последним диапазоном веса стоимость не определена (NaN), за последним порогом
+    срочности множитель равен 1. Скидки - плотный массив, индексированный id клиента.
+    """
+    cursor = db.cursor()
+    cursor.row_factory = None
+
+    bands = np.array(cursor.execute(
+        'SELECT max_weight, base_price, price_per_km FROM tariff_weight_bands ORDER BY max_weight'
+    ).fetchall(), dtype=np.float64).reshape(-1, 3)
+    urgency = np.array(cursor.execute(
+        'SELECT max_days, multiplier FROM tariff_urgency ORDER BY max_days'
+    ).fetchall(), dtype=np.float64).reshape(-1, 2)
+    discounts = np.array(cursor.execute(
+        'SELECT client_id, discount_percent FROM client_discounts'
+    ).fetchall(), dtype=np.float64).reshape(-1, 2)
+
+    discount = np.zeros(int(discounts[:, 0].max()) + 1 if len(discounts) else 1)
+    discount[discounts[:, 0].astype(np.int64)] = discounts[:, 1] / 100
+
+    return {
+        'max_weight': bands[:, 0],
+        'base_price': np.append(bands[:, 1], np.nan),
+        'price_per_km': np.append(bands[:, 2], np.nan),
+        'urgency_days': urgency[:, 0],
+        'urgency_multiplier': np.append(urgency[:, 1], 1.0),
+        'discount': discount,
+    }
+
+def get_tariffs(db):
+    """Закешированные тарифы; пересчитываются после изменения тарифных таблиц
+
+    Версия в tariff_version увеличивается триггерами тарифных таблиц, поэтому
+    проверка актуальности кеша - чтение одной строки.
+    """
+    version = db.execute('SELECT version FROM tariff_version').fetchone()[0]
+    with _cache_lock:
+        if _cache['version'] != version:
+            _cache['tariffs'] = load_tariffs(db)
+            _cache['version'] = version
+        return _cache['tariffs']
+
+def to_number(value, default=0.0):
+    """Число из значения формы или JSON (пустое значение - default)"""
+    if value is None or value == '':
+        return default
+    return float(value)
+
+def quote_orders(db, orders, today=None):
+    """Векторный расчет стоимости для списка заказов
+
+    orders: словари (или строки БД) с client_id, weight, address_from, address_to и
+    planned_delivery_date (пустой вес считается нулевым, поэтому при создании заказа
+    без веса расчет не выполняется). Возвращает словарь массивов: distance_km, base_price,
+    urgency_multiplier, discount, cost. Для заказов тяжелее последнего весового
+    диапазона или между неизвестными городами cost равна NaN. ValueError - при
+    некорректных весе, клиенте или дате.
+    """
+    tariffs = get_tariffs(db)
+    count = len(orders)
+    today = np.datetime64(today or datetime.now().date(), 'D')
+
+    try:
+        weights = np.fromiter((to_number(o['weight']) for o in orders), dtype=np.float64, count=count)
+        clients = np.fromiter((int(to_number(o['client_id'], -1)) for o in orders), dtype=np.int64, count=count)
+        dates = np.array([str(o['planned_delivery_date'])[:10] if o['planned_delivery_date'] else 'NaT'
+                          for o in orders], dtype='datetime64[D]')
+    except (TypeError, ValueError):
+        raise ValueError('Некорректные вес, клиент или плановая дата доставки')
+    if (weights < 0).any():
+        raise ValueError('Вес не может быть отрицательным')
+    distances = np.fromiter((np.nan if (d := distance_km(o['address_from'], o['address_to'])) is None else d
+                             for o in orders), dtype=np.float64, count=count)
+
+    band = np.searchsorted(tariffs['max_weight'], weights, side='left')
+    base_price = tariffs['base_price'][band] + tariffs['price_per_km'][band] * distances
+
+    days = (dates - today).astype(np.float64)
+    days[np.isnat(dates)] = np.inf
+    urgency = tariffs['urgency_multiplier'][np.searchsorted(tariffs['urgency_days'], days, side='left')]
+
+    discount = np.zeros(count)
+    known = (clients >= 0) & (clients < len(tariffs['discount']))
+    discount[known] = tariffs['discount'][clients[known]]
+
+    return {
+        'distance_km': distances,
+        'base_price': base_price,
+        'urgency_multiplier': urgency,
+        'discount': discount,
+        'cost': np.round(base_price * urgency * (1 - discount)),
+    }
+
+def quote_order(db, order, today=None):
+    """Расчет стоимости одного заказа: словарь составляющих или None, если тарифа нет"""
+    quote = quote_orders(db, [order], today)
+    if np.isnan(quote['cost'][0]):
+        return None
+    return {
+        'cost': float(quote['cost'][0]),
+        'distance_km': float(quote['distance_km'][0]),
+        'base_price': round(float(quote['base_price'][0]), 2),
+        'urgency_multiplier': float(quote['urgency_multiplier'][0]),
+        'discount_percent': round(float(quote['discount'][0]) * 100, 2),
+    }
+
+if __name__ == '__main__':
+    # Бенчмарк пакетного расчета: python -m app.tariffs
+    import os
+    import random
+    import sqlite3
+    import tempfile
+    import time
+    from datetime import timedelta
+
+    from app.geo import CITY_COORDINATES
+    from app.init_db import init_database
+
+    random.seed(0)
+    path = os.path.join(tempfile.mkdtemp(), 'tariffs_bench.db')
+    init_database(path)
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.executemany('INSERT INTO clients (name) VALUES (?)', [(f'Клиент {i}',) for i in range(1_000)])
+    db.executemany('INSERT INTO client_discounts (client_id, discount_percent) VALUES (?, ?)',
+                   [(i, random.choice((3, 5, 10))) for i in range(1, 1_000, 7)])
+    db.commit()
+
+    cities = list(CITY_COORDINATES)
+    today = datetime.now().date()
+    candidates = [{
+        'client_id': random.randint(1, 1_000),
+        'weight': round(random.uniform(0.1, 35), 2),
+        'address_from': f'{random.choice(cities)}, склад №{random.randint(1, 5)}',
+        'address_to': f'{random.choice(cities)}, ул. Тестовая, {random.randint(1, 200)}',
+        'planned_delivery_date': (today + timedelta(days=random.randint(0, 20))).isoformat(),
+    } for _ in range(QUOTE_BATCH_LIMIT)]
+
+    started = time.perf_counter()
+    get_tariffs(db)
+    print(f'Загрузка тарифов: {(time.perf_counter() - started) * 1000:.1f} мс')
+
+    started = time.perf_counter()
+    quotes = quote_orders(db, candidates)
+    batch_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    singles = [quote_order(db, order) for order in candidates[:1_000]]
+    single_time = (time.perf_counter() - started) / 1_000 * len(candidates)
+
+    priced = int(np.count_nonzero(~np.isnan(quotes['cost'])))
+    print(f'Заказов: {len(candidates)}, рассчитано: {priced}, пакетом: {batch_time * 1000:.0f} мс, '
+          f'по одному (оценка): {single_time * 1000:.0f} мс')
+    assert all(s is None and np.isnan(c) or s['cost'] == c for s, c in zip(singles, quotes['cost']))
+
+    db.execute('UPDATE tariff_urgency SET multiplier = multiplier + 0.05')
+    db.commit()
+    started = time.perf_counter()
+    quote_orders(db, candidates)
+    print(f'Пакет после изменения тарифов (с перезагрузкой): {(time.perf_counter() - started) * 1000:.0f} мс')
+    db.close()